@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+"""adaptive.py: Adaptive concurrency of requests to the IncidentIQ API
+
+Rate limits of the IncidentIQ API are not documented, so rather than
+hand tuning Threads (or Concurrency) per environment, an AIMD controller
+can find the number of requests in flight the API sustains. Starting
+low, the limit doubles every round trip while requests succeed at a flat
+latency, then grows by one per round trip (additive increase). When a
+request is throttled (429 or 503), times out, or the latency of its
+endpoint spikes well above the best seen, the limit is halved
+(multiplicative decrease), at most once per round trip. The configured
+Threads or Concurrency remains the upper bound. The limit chosen is
+reported at the end of a sync.
+"""
+
+import asyncio
+import threading
+import time
+import config
+
+# Statuses which mean the API is overloaded
+THROTTLED_STATUSES = (429, 503)
+# Smoothing of the latency average of every endpoint
+LATENCY_SMOOTHING = 0.2
+# Seconds a latency average must rise above the best before it is a spike,
+# so jitter of fast responses is not mistaken for congestion
+MIN_LATENCY_SPIKE = 0.25
+
+
+class AIMDController:
+    """AIMDController gates requests so at most limit are in flight, and
+    adjusts limit from the outcome and latency of every request. A latency
+    average above latency_tolerance times the best average of its endpoint
+    counts as congestion. Safe to use from any number of threads, or from
+    coroutines of a single event loop.
+    """
+
+    def __init__(self, max_limit, min_limit=1, latency_tolerance=2.0):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.latency_tolerance = latency_tolerance
+        self.limit = float(min(max_limit, max(min_limit, 4)))
+        self.slow_start = True    # Doubling until the first congestion
+        self.inflight = 0
+        self.peak = self.limit
+        self.decreases = 0
+        self.last_decrease = 0.0    # perf_counter of the last decrease
+        self.latency = {}    # Endpoint -> [average latency, best average]
+        self.condition = threading.Condition()
+        self.changed = None    # asyncio.Event set when a slot frees up
+
+    # Take a slot if one is free, returns the start time of the request or
+    # None if limit requests are already in flight
+    def try_acquire(self):
+        with self.condition:
+            if self.inflight >= int(self.limit):
+                return None
+            self.inflight += 1
+            return time.perf_counter()
+
+    # Wait for a free slot from a thread, returns the start time
+    def acquire(self):
+        with self.condition:
+            while self.inflight >= int(self.limit):
+                self.condition.wait()
+            self.inflight += 1
+            return time.perf_counter()
+
+    # Wait for a free slot from a coroutine, returns the start time
+    async def acquire_async(self):
+        start = self.try_acquire()
+        while start is None:
+            if self.changed is None:
+                self.changed = asyncio.Event()
+            await self.changed.wait()
+            start = self.try_acquire()
+        return start
+
+    # Free the slot of a request to endpoint started at start. status is the
+    # status returned, or None if the request timed out or failed to connect
+    def release(self, start, endpoint, status=None):
+        now = time.perf_counter()
+        with self.condition:
+            self.inflight -= 1
+            congested = status is None or status in THROTTLED_STATUSES
+            if status == 200:
+                congested = self.__observe_latency(endpoint, now - start)
+            if congested:
+                # Only requests started after the last decrease reflect it
+                if start > self.last_decrease:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                    self.slow_start = False
+                    self.decreases += 1
+                    self.last_decrease = now
+            elif status == 200:
+                # One more slot per round trip, a doubling in slow start
+                self.limit = min(
+                    self.max_limit,
+                    self.limit + (1 if self.slow_start else 1 / self.limit))
+                self.peak = max(self.peak, self.limit)
+            self.condition.notify_all()
+        if self.changed is not None:
+            self.changed.set()
+            self.changed = None
+
+    # Smooth a successful latency into the average of its endpoint, returns
+    # True if the average spiked above the tolerance. The condition's lock
+    # must be held.
+    def __observe_latency(self, endpoint, latency):
+        averages = self.latency.get(endpoint)
+        if averages is None:
+            self.latency[endpoint] = [latency, latency]
+            return False
+        averages[0] += LATENCY_SMOOTHING * (latency - averages[0])
+        averages[1] = min(averages[1], averages[0])
+        return (averages[0] > self.latency_tolerance * averages[1] and
+                averages[0] - averages[1] > MIN_LATENCY_SPIKE)
+
+    # Eg. 'Adaptive concurrency: settled at 18 requests (peak 36, 3 decreases)'
+    def report(self):
+        with self.condition:
+            return ("Adaptive concurrency: settled at %d requests "
+                    "(peak %d, %d decreases)" %
+                    (self.limit, self.peak, self.decreases))
+
+
+# The controller of every request made in this process, None unless
+# Adaptive is enabled. Bounded by the concurrency of the configured Engine.
+controller = None
+if config.ADAPTIVE:
+    controller = AIMDController(
+        config.CONCURRENCY if config.ENGINE == 'async' else int(
+            config.THREADS))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""api.py: Shared HTTP transport for the IncidentIQ API
+
+All requests made to the IncidentIQ API pass through this module. A single
+pooled requests.Session is created per process and shared between every
+worker thread, so connections to the IncidentIQ instance are kept alive and
+reused between pages instead of paying a fresh TCP and TLS handshake for
+every request. Headers common to every request (authorization etc.) are
+built once and attached to the session.
+"""
+
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from requests.models import HTTPError
+import config
+import retry
+import adaptive
+
+# Headers sent with every request to the IncidentIQ API
+HEADERS = {
+    'Client': 'WebBrowser',
+    'Accept': 'application/json, text/plain, */*',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.106 Safari/537.36',
+    'Accept-Encoding': 'gzip, deflate',
+    'Content-Type': 'application/json',
+    'Connection': 'keep-alive',
+    'Authorization': 'Bearer ' + config.IIQ_TOKEN
+}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+# Returns the process wide session, creating it on first use. The connection
+# pool is sized to config.THREADS so every worker thread can hold a kept-alive
+# connection. pool_block makes surplus threads wait for a free connection
+# rather than opening (and later discarding) extra sockets.
+def get_session():
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=int(config.THREADS),
+                                      pool_block=True)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update(HEADERS)
+                _session = session
+    return _session
+
+
+# Returns the full url for a path on the configured IncidentIQ instance
+# Eg. url('/api/v1.0/teams/all') -> 'https://cps.incidentiq.com/api/v1.0/teams/all'
+def url(path):
+    return config.IIQ_SCHEME + "://" + config.IIQ_INSTANCE + path
+
+
+# Make a request to the IncidentIQ API over the shared session. path is
+# the path (and query string) on the configured instance. Transient failures
+# are retried with the retry policy (See retry.py). Raises an HTTPError if
+# anything but success is returned once retries are exhausted. When stream is
+# set, a successful response is returned before its body is read, and must be
+# closed once read (See streaming.py).
+def request(method, path, data=None, stream=False):
+    endpoint = retry.endpoint(path)
+    attempt = 0
+    while True:
+        retry.stats.record_request(endpoint)
+        # Wait for a slot when concurrency is adaptive (See adaptive.py)
+        controller = adaptive.controller
+        start = controller.acquire() if controller is not None else None
+        try:
+            response = get_session().request(method,
+                                             url(path),
+                                             data=data,
+                                             timeout=config.TIMEOUT,
+                                             stream=stream)
+        except Exception as e:
+            if controller is not None:
+                controller.release(start, endpoint)
+            # Only timeouts and dropped connections are worth retrying
+            if not isinstance(e, (requests.Timeout, requests.ConnectionError)
+                             ) or not retry.policy.should_retry(attempt):
+                raise
+            reason, retry_after = 'timeout', None
+        else:
+            if controller is not None:
+                controller.release(start, endpoint, response.status_code)
+            if response.status_code == 200:
+                return response
+            # Cause an exception if anything but success is returned, and it
+            # is not worth retrying
+            if not retry.policy.should_retry(attempt, response.status_code):
+                raise HTTPError(
+                    """A request returned a status code other than 200\n
+            Status Code: """ + str(response.status_code),
+                    response=response)
+            reason = str(response.status_code)
+            retry_after = response.headers.get('Retry-After')
+            # Release the connection of a response which is not read
+            response.close()
+
+        retry.stats.record_retry(endpoint, reason)
+        time.sleep(retry.policy.delay(attempt, retry_after))
+        attempt += 1
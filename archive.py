@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+"""archive.py: Archive of the raw API pages of a sync, and its replay
+
+When Archive is set in config.ini, every page fetched from the
+IncidentIQ API is kept in the archive directory exactly as returned,
+before any record is filtered out or written, as gzip compressed NDJSON
+(Eg. Archive/Asset/00012.ndjson.gz). The first line of a page holds its
+page number, the since it was requested with and the rest of the
+response (Eg. Paging), every other line holds one item. The custom field
+definitions of users, assets and tickets are archived alongside
+(Eg. Archive/CustomFields/AggregateAsset.json.gz). The archive of a type
+holds the pages of its last sync, they are removed when it syncs again.
+
+A sync run with --replay requests nothing from the API, every page and
+custom field definition is read from the archive instead and decoded
+and written exactly as a fetched page is, at the speed of the disk. This
+reloads the database after a schema change or while tuning the writers
+without waiting on the API, and gives benchmarks of the load path a
+reproducible input.
+"""
+
+import gzip
+import json
+import os
+import shutil
+import config
+
+# Directory of custom field definitions in the archive
+FIELDS_DIRECTORY = 'CustomFields'
+# Compression of archived pages, a fast level as pages are archived while
+# syncing
+COMPRESS_LEVEL = 3
+
+# The archive directory pages are written to, or read from when replaying.
+# None unless Archive is set or a replay is started
+directory = config.ARCHIVE or None
+# Whether pages are read from the archive rather than requested
+replaying = False
+
+
+# Read every page from the archive in path, or the configured Archive,
+# rather than requesting it from the API
+def start_replay(path=None):
+    global directory, replaying
+    directory = path or directory
+    if directory is None or not os.path.isdir(directory):
+        raise FileNotFoundError("There is no archive to replay at %s" %
+                                directory)
+    replaying = True
+
+
+# Whether fetched pages are written to the archive
+def archiving():
+    return directory is not None and not replaying
+
+
+def page_path(type_name, page_number):
+    return os.path.join(directory, type_name, '%05d.ndjson.gz' % page_number)
+
+
+def fields_path(strategy):
+    return os.path.join(directory, FIELDS_DIRECTORY, strategy + '.json.gz')
+
+
+# Write to path atomically through a temporary file, so a sync interrupted
+# while archiving never leaves a truncated page behind
+def write(path, lines):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = path + '.tmp'
+    with gzip.open(temporary, 'wt', encoding='utf-8',
+                   compresslevel=COMPRESS_LEVEL) as archive_file:
+        for line in lines:
+            archive_file.write(line)
+            archive_file.write('\n')
+    os.replace(temporary, path)
+
+
+# Archive the decoded response data of a page of a type, requested with since
+def save_page(type_name, page_number, data, since=None):
+    header = {
+        'PageNumber': page_number,
+        'Since': since,
+        'Response': {key: value for key, value in data.items() if key != 'Items'}
+    }
+    write(page_path(type_name, page_number),
+          [json.dumps(header)] + [json.dumps(item) for item in data['Items']])
+
+
+# Returns the decoded response data of an archived page of a type, as it was
+# returned by the API
+def load_page(type_name, page_number):
+    with gzip.open(page_path(type_name, page_number), 'rt',
+                   encoding='utf-8') as archive_file:
+        header = json.loads(archive_file.readline())
+        data = dict(header['Response'])
+        data['Items'] = [json.loads(line) for line in archive_file if line.strip()]
+    return data
+
+
+# Archive the custom fields of a strategy, 'Field UUID' -> 'Field Name'
+def save_fields(strategy, fields):
+    write(fields_path(strategy), [json.dumps(fields)])
+
+
+# Returns the archived custom fields of a strategy
+def load_fields(strategy):
+    with gzip.open(fields_path(strategy), 'rt',
+                   encoding='utf-8') as archive_file:
+        return json.load(archive_file)
+
+
+# Remove every archived page of a type, which is about to be synced again
+def clear(type_name):
+    shutil.rmtree(os.path.join(directory, type_name), ignore_errors=True)
@@ -9,12 +9,11 @@ IncidentIQ to insert into the specified database.
 
 from sqlalchemy import Column, String, Integer, Date, Boolean, Numeric
 from sqlalchemy_utils.types.uuid import UUIDType as UNIQUEIDENTIFIER
-import requests
-from requests.models import HTTPError
 from sqlalchemy.orm.mapper import validates
 from base import Base, IIQ_Datatype as IIQ
 from custom_fields import AssetCustomFields
 import config
+import json
 
 
 class Asset(Base, IIQ):
@@ -32,8 +31,7 @@ class Asset(Base, IIQ):
         __table_args__ = {'schema': config.SCHEMA}
 
     # Retrieve custom fields
-    custom_fields = AssetCustomFields.parse_fields(
-        AssetCustomFields.get_fields_request(0))
+    custom_fields = AssetCustomFields.field_definitions
 
     AssetId = Column(UNIQUEIDENTIFIER(binary=False), primary_key=True)
     SiteId = Column(UNIQUEIDENTIFIER(binary=False))
@@ -104,82 +102,62 @@ class Asset(Base, IIQ):
         'StorageUnitNumber', 'Vendor', 'WarrantyExpirationDate', 'WarrantyInfo'
     ]
 
+    # Nested fields are more complex, and thus are commented in the declaration
+    # as Nested. We simply path these out by hand since there are only a few, and
+    # often they are purposeful inclusions that aren't nescessary but useful to
+    # end users. This is harmless even if they are optional fields in the API response,
+    # since the extractor will set them to None by default
+    paths = {
+        'StatusName': ('Status', 'Name'),
+        'ModelName': ('Model', 'Name'),
+        'CategoryId': ('Model', 'CategoryId'),
+        'CategoryName': ('Model', 'Category', 'Name'),
+        'OwnerName': ('Owner', 'Name'),
+        'OwnerUsername': ('Owner', 'Username'),
+        'LocationName': ('Location', 'Name'),
+        'LocationRoomName': ('LocationRoom', 'Name')
+    }
+
     # Validator ensures empty strings are entered as null
     @validates(*fields)
     def validate_inserts(self, key, value):
         return super().validate_inserts(key, value)
 
     def __init__(self, data):
-        # Extract fields from the raw data, optional fields are retrieved
-        # safely via find_element
-        for field in self.fields:
-            # For non-nested fields that exist at the first level of the JSON
-            # we can use setattr to assign values, since the fields are
-            # named exactly as they appear in the JSON. Convention over configuration
-            # wins here. For example, an asset JSON response will have a field 'AssetId'
-            # at the base level of that item. Thus, find_element can grab it simply by being
-            # passed 'AssetId'. By design, the column is also named 'AssetId', so we can
-            # iterate simply and set these fields.
-            setattr(self, field, IIQ.find_element(data, field))
-
-        # Nested fields are more complex, and thus are commented in the declaration
-        # as Nested. We simply path these out by hand since there are only a few, and
-        # often they are purposeful inclusions that aren't nescessary but useful to
-        # end users. This is harmless even if they are optional fields in the API response,
-        # since find_element will set them to None by default
-        self.StatusName = IIQ.find_element(data, 'Status', 'Name')
-        self.ModelName = IIQ.find_element(data, 'Model', 'Name')
-        self.CategoryId = IIQ.find_element(data, 'Model', 'CategoryId')
-        self.CategoryName = IIQ.find_element(data, 'Model', 'Category', 'Name')
-        self.OwnerName = IIQ.find_element(data, 'Owner', 'Name')
-        self.OwnerUsername = IIQ.find_element(data, 'Owner', 'Username')
-        self.LocationName = IIQ.find_element(data, 'Location', 'Name')
-        self.LocationRoomName = IIQ.find_element(data, 'LocationRoom', 'Name')
+        # Extract fields from the raw data with the extractor compiled once
+        # for Asset from fields and paths (See IIQ_Datatype.__init_subclass__).
+        # Convention over configuration wins here. For example, an asset JSON
+        # response will have a field 'AssetId' at the base level of that item.
+        # By design, the column is also named 'AssetId', so only nested fields
+        # need an explicit path.
+        self.set_fields(data)
 
-    @staticmethod
-    def get_data_request(page):
-        url = "https://" + config.IIQ_INSTANCE + "/api/v1.0/assets/?$p=" + str(
+    # Assets can be requested modified since a watermark
+    incremental = True
+
+    @classmethod
+    def page_request(cls, page, since=None):
+        # Always sorted by AssetTag, changes made during the sync then never
+        # move a record to another page. An asset created meanwhile does,
+        # shifting every asset after its tag by one (See README.md)
+        path = "/api/v1.0/assets/?$p=" + str(
             page) + "&$s=" + config.PAGE_SIZE + "&$d=Ascending&$o=AssetTag"
 
-        payload = "{\n    \"OnlyShowDeleted\": false,\n    \"Filters\": [\n        {\n            \"Facet\": \"AssetType\",\n            \"Id\": \"2a1561e5-34ff-4fcf-87de-2a146f0e1c01\"\n        }\n    ],\n    \"FilterByViewPermission\": true\n}"
-        headers = {
-            'Connection': 'keep-alive',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/80.0.3987.149 Safari/537.36',
-            'Client': 'WebBrowser',
-            'Content-Type': 'application/json',
-            'Accept': 'application/json, text/plain, */*',
-            'Sec-Fetch-Site': 'same-origin',
-            'Sec-Fetch-Mode': 'cors',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Authorization': 'Bearer ' + config.IIQ_TOKEN
+        payload = {
+            "OnlyShowDeleted": False,
+            "Filters": [{
+                "Facet": "AssetType",
+                "Id": "2a1561e5-34ff-4fcf-87de-2a146f0e1c01"
+            }],
+            "FilterByViewPermission": True
         }
+        payload["Filters"] += cls.request_filters(since)
 
-        response = requests.request("POST",
-                                    url,
-                                    headers=headers,
-                                    data=payload,
-                                    timeout=config.TIMEOUT)
-        # Cause an exception if anything but success is returned
-        if response.status_code != 200:
-            print("ERROR: STATUS CODE NOT 200")
-            raise HTTPError("""A request returned a status code other than 200\n
-            Status Code: """ + str(response.status_code))
-
-        # Cause an exception if for some reason the API returns nothing
-        if response.json()['Paging']['PageSize'] <= 0:
-            print("ERROR NO ELEMENTS WERE RETURNED")
-            raise HTTPError("No elements were returned from a request")
-
-        return response
-
-    @staticmethod
-    def get_num_pages():
-        return Asset.get_data_request(0).json()['Paging']['PageCount']
+        return "POST", path, json.dumps(payload)
 
     @classmethod
-    def get_page(cls, page_number):
-        return super().get_page(page_number)
+    def get_page(cls, page_number, page=None):
+        return super().get_page(page_number, page)
 
     @staticmethod
     def get_custom_type():
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+"""async_engine.py: Fetch pages on an event loop rather than a thread each
+
+The async engine keeps up to config.CONCURRENCY page requests to the
+IncidentIQ API in flight on a single thread with asyncio and aiohttp,
+instead of blocking a worker thread (and a database connection) per
+request. Responses are read on the event loop, then decoded and written
+to the database by a bounded pool of config.WRITERS writer threads, so
+the number of database connections no longer grows with the number of
+requests in flight. A request slot is only released once its page has
+been written, so at most config.CONCURRENCY pages are held in memory.
+The pages of every type are requested on the same event loop, largest
+type first (See scheduler.py for the threads engine).
+
+aiohttp is an optional dependency, only required when Engine is async.
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import time
+from requests.models import HTTPError
+import api
+import config
+import retry
+import adaptive
+import archive
+import metrics
+import profiling
+import streaming
+from base import StreamedPage
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+# Request a page of cls over session, returns the raw response body.
+# Transient failures are retried with the retry policy as for api.request.
+# Raises an HTTPError if anything but success is returned once retries are
+# exhausted.
+async def fetch_body(session, cls, page_number, since=None):
+    if since is None:
+        method, path, payload = cls.page_request(page_number)
+    else:
+        method, path, payload = cls.page_request(page_number, since)
+    endpoint = retry.endpoint(path)
+    attempt = 0
+    while True:
+        retry.stats.record_request(endpoint)
+        # Wait for a slot when concurrency is adaptive (See adaptive.py)
+        controller = adaptive.controller
+        start = None
+        if controller is not None:
+            start = await controller.acquire_async()
+        try:
+            async with session.request(method, api.url(path),
+                                       data=payload) as response:
+                body = await response.read()
+        except Exception as e:
+            if controller is not None:
+                controller.release(start, endpoint)
+            # Only timeouts and dropped connections are worth retrying
+            if not isinstance(e, (asyncio.TimeoutError,
+                                  aiohttp.ClientConnectionError,
+                                  aiohttp.ClientPayloadError)
+                             ) or not retry.policy.should_retry(attempt):
+                raise
+            reason, retry_after = 'timeout', None
+        else:
+            if controller is not None:
+                controller.release(start, endpoint, response.status)
+            if response.status == 200:
+                return body
+            if not retry.policy.should_retry(attempt, response.status):
+                raise HTTPError(
+                    """A request returned a status code other than 200\n
+            Status Code: """ + str(response.status))
+            reason = str(response.status)
+            retry_after = response.headers.get('Retry-After')
+
+        retry.stats.record_retry(endpoint, reason)
+        await asyncio.sleep(retry.policy.delay(attempt, retry_after))
+        attempt += 1
+
+
+# Decode the response body of a page of cls into a Page, archiving the
+# response when Archive is set. When Streaming is set (and not archiving)
+# returns a StreamedPage decoding the items of body as they are written,
+# unless whole is set (Eg. page 0, whose paging is needed at once).
+def decode(cls, page_number, body, since=None, whole=False):
+    if config.STREAMING and not whole and not archive.archiving():
+        return StreamedPage(cls,
+                            page_number,
+                            streaming.body_chunks(body),
+                            since,
+                            config.STREAM_BATCH_SIZE,
+                            size=len(body))
+    with metrics.stats.time(cls.__name__, 'decode'):
+        data = json.loads(body)
+    if archive.archiving():
+        archive.save_page(cls.__name__, page_number, data, since)
+    return cls.make_page(page_number, data, since, len(body))
+
+
+# Sync every page of every type in syncs, a list of (cls, since, process, cap,
+# skip) tuples, on one event loop. process(page_number, page) is called with every
+# decoded Page of cls from a pool of writers threads. Page 0 of every type is
+# requested first for its page count, then requests are made for the pages of
+# the largest type first, with at most cap pages of a type in flight when cap
+# is not None. Page numbers in skip are not synced. first_pages optionally
+# holds the Page 0 already fetched for every cls, or the exception raised
+# fetching it (See bootstrap.py). Returns a dict of (cls, page number) -> the
+# result of process or the exception raised fetching or processing the page.
+async def run(syncs, concurrency=100, writers=4, first_pages=None):
+    if aiohttp is None:
+        raise ImportError(
+            "The async Engine requires aiohttp (pip install aiohttp)")
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=config.TIMEOUT)
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=writers) as executor:
+        async with aiohttp.ClientSession(headers=api.HEADERS,
+                                         connector=connector,
+                                         timeout=timeout) as session:
+
+            # Request and decode one page, whole when whole is set
+            async def fetch_page(cls, page_number, since, whole=False):
+                try:
+                    start = time.perf_counter()
+                    body = await fetch_body(session, cls, page_number, since)
+                    metrics.stats.record(cls.__name__, 'http',
+                                         time.perf_counter() - start)
+                    metrics.stats.record_bytes(cls.__name__, len(body))
+                    return await loop.run_in_executor(executor,
+                                                      profiling.wrap(decode),
+                                                      cls, page_number, body,
+                                                      since, whole)
+                except Exception as e:
+                    print("A request for page %d of %s failed" %
+                          (page_number, cls.__name__), e)
+                    raise e
+
+            # Fetch (unless already fetched), decode and write one page,
+            # holding a request slot until the page is written
+            async def sync_page(cls, page_number, since, process, limit,
+                                page=None):
+                async with limit, semaphore:
+                    if page is None:
+                        page = await fetch_page(cls, page_number, since)
+                    return await loop.run_in_executor(executor, process,
+                                                      page_number, page)
+
+            if first_pages is None:
+                first_pages = dict(
+                    zip((sync[0] for sync in syncs), await asyncio.gather(
+                        *(fetch_page(cls, 0, since, whole=True)
+                          for cls, since, _, _, _ in syncs),
+                        return_exceptions=True)))
+            results = {}
+            ready = []    # (page count, sync, first page) of every type
+            for sync in syncs:
+                # Only the write of page 0 holds it, so it is freed once written
+                first_page = first_pages.pop(sync[0])
+                if isinstance(first_page, Exception):
+                    results[(sync[0], 0)] = first_page
+                else:
+                    ready.append((first_page.page_count, sync, first_page))
+
+            # Pages wait for a request slot in the order they are created,
+            # the pages of the largest type are created first
+            ready.sort(key=lambda entry: entry[0], reverse=True)
+            keys, pages = [], []
+            for page_count, (cls, since, process, cap,
+                             skip), first_page in ready:
+                limit = asyncio.Semaphore(cap or concurrency)
+                for page_number in range(page_count):
+                    if page_number in skip:
+                        continue
+                    keys.append((cls, page_number))
+                    pages.append(
+                        sync_page(cls, page_number, since, process, limit,
+                                  first_page if page_number == 0 else None))
+            ready = first_page = None
+            results.update(
+                zip(keys, await asyncio.gather(*pages,
+                                               return_exceptions=True)))
+            return results
+
+
+# Sync every type in syncs with the configured concurrency and writers,
+# see run
+def sync(syncs, first_pages=None):
+    return asyncio.run(
+        run(syncs, config.CONCURRENCY, config.WRITERS, first_pages))
@@ -19,21 +19,279 @@ from sqlalchemy.orm import mapper    # 'Unused' imports needed for pyinstaller
 from sqlalchemy.sql import default_comparator
 from sqlalchemy.ext import baked
 from sqlalchemy.dialects.mysql import mysqldb
+from sqlalchemy.dialects import sqlite
 import sqlalchemy
+import time
+from datetime import datetime
 from types import SimpleNamespace as Namespace
+from requests.models import HTTPError
 import config
+import loaders
+import api
+import archive
+import metrics
+import streaming
 
-# Create nescessary SqlAlchemy binds
-engine = sqlalchemy.create_engine(config.DB_CONNECTION_STRING,
-                                  pool_size=int(config.THREADS),
-                                  max_overflow=0,
-                                  pool_timeout=120)
+# Pages are only written by the config.WRITERS writer threads, each holding at
+# most one connection. SQLite connects to its file without a pool of
+# connections, a writer waits for the lock of the file held by another
+if config.DB_CONNECTION_STRING.lower().startswith('sqlite'):
+    pool_options = {'connect_args': {'timeout': 120}}
+else:
+    pool_options = {
+        'pool_size': config.WRITERS,
+        'max_overflow': 0,
+        'pool_timeout': 120
+    }
+# Create nescessary SqlAlchemy binds, enabling the bulk path of the
+# configured dialect (See loaders.py)
+engine = sqlalchemy.create_engine(
+    config.DB_CONNECTION_STRING, **pool_options,
+    **loaders.engine_options(config.DB_CONNECTION_STRING))
 # Create a scoped session for thread safety, attempting to commit multiple sessions
 # at once
 Session = scoped_session(sessionmaker(bind=engine))
 Base = declarative_base()
 
 
+# Validator ensures empty strings are entered as null and
+# strings never exceed the capacity imposed by multi-database support.
+# The smallest VARCHAR type we support is 4,000 characters due to
+# ORACLE DB. There is probably no good reason for any asset to have a
+# string this long in the database
+def validate_value(value):
+    if isinstance(value, str) and value == '':
+        return None    # Set empty string to None (Null in databases)
+    elif isinstance(value, str) and len(value) >= config.STRING_LENGTH:
+        return value[0:config.STRING_LENGTH - 1]    # Truncate the string
+    else:
+        return value
+
+
+# Parse a date returned by the IncidentIQ API into a datetime so dates with
+# differing precision compare correctly. Eg. '2021-07-09T15:27:28.053Z'
+# Returns None for missing or unparseable dates.
+def parse_date(value):
+    if not isinstance(value, str) or len(value) < 10:
+        return None
+    value = value.rstrip('Z')
+    if '.' in value:
+        # fromisoformat accepts at most microsecond precision
+        whole, fraction = value.split('.', 1)
+        value = whole + '.' + fraction[:6].ljust(6, '0')
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+class SQLiteDate(sqlite.DATE):
+    """SQLiteDate binds the date strings of the API, which other databases
+    accept as is, as the date objects SQLite's Date type requires.
+    """
+
+    def bind_processor(self, dialect):
+        process = super().bind_processor(dialect)
+
+        def bind(value):
+            if isinstance(value, str):
+                value = parse_date(value)
+                value = value.date() if value is not None else None
+            return process(value)
+
+        return bind
+
+
+class SQLiteDateTime(sqlite.DATETIME):
+    """SQLiteDateTime binds the date strings of the API as the datetime
+    objects SQLite's DateTime type requires.
+    """
+
+    def bind_processor(self, dialect):
+        process = super().bind_processor(dialect)
+
+        def bind(value):
+            if isinstance(value, str):
+                value = parse_date(value)
+            return process(value)
+
+        return bind
+
+
+# Dates are bound with SQLiteDate and SQLiteDateTime on SQLite
+if engine.dialect.name == 'sqlite':
+    engine.dialect.colspecs = dict(engine.dialect.colspecs)
+    engine.dialect.colspecs[sqlalchemy.Date] = SQLiteDate
+    engine.dialect.colspecs[sqlalchemy.DateTime] = SQLiteDateTime
+
+
+# Format a datetime the way the IncidentIQ API does, to millisecond
+# precision Eg. '2021-07-09T15:27:28.053Z'
+def format_date(value):
+    return value.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (
+        value.microsecond // 1000)
+
+
+# Compiles a mapping of column name -> JSON path into a single extractor
+# function. Paths are tuples of keys, one for each level of nesting in the
+# returned JSON Eg. {'StatusName': ('Status', 'Name')}. The generated function
+# takes one decoded API item (a dict) and returns a dict of column -> value,
+# with None for any path that does not exist in the item. Intermediate objects
+# shared by several paths (Eg. 'Model' for ModelName and CategoryId) are only
+# looked up once.
+def compile_extractor(paths):
+    lines = ['def extract(item):']
+    prefixes = {(): 'item'}    # Path prefix -> local variable holding it
+    entries = []
+
+    # Safely look up key in the object held by variable, any non dict
+    # (a missing or null parent) results in None
+    def lookup(variable, key):
+        if variable == 'item':
+            return 'item.get(%r)' % key
+        return '(%s.get(%r) if %s.__class__ is dict else None)' % (
+            variable, key, variable)
+
+    for column, path in paths.items():
+        # Bind every not yet seen parent of the path to a local variable
+        for depth in range(1, len(path)):
+            if path[:depth] not in prefixes:
+                variable = '_%d' % len(prefixes)
+                lines.append('    %s = %s' %
+                             (variable,
+                              lookup(prefixes[path[:depth - 1]],
+                                     path[depth - 1])))
+                prefixes[path[:depth]] = variable
+        entries.append('%r: %s' %
+                       (column, lookup(prefixes[path[:-1]], path[-1])))
+
+    lines.append('    return {' + ', '.join(entries) + '}')
+    namespace = {}
+    exec('\n'.join(lines), namespace)
+    return namespace['extract']
+
+
+# Estimated bytes in memory of a decoded page, its items and the rows or
+# objects built from them, per byte of its response body
+DECODED_SIZE_FACTOR = 5
+
+
+class Page:
+    """Page is one decoded page of an IncidentIQ API response. The
+    response body is decoded exactly once, the paging metadata and
+    the returned items are both kept so the page can be used to
+    count the pages of a type as well as be synced into the database.
+    size is the bytes of the response body, when known.
+    """
+
+    def __init__(self, number, data, size=None):
+        self.number = number
+        self.paging = data['Paging']
+        self.items = data['Items']
+        self.size = size
+
+    # Estimated bytes the page holds in memory until written, or None
+    @property
+    def memory(self):
+        if self.size is None:
+            return None
+        return self.size * DECODED_SIZE_FACTOR
+
+    # Items the page holds in memory at once
+    @property
+    def items_held(self):
+        return len(self.items)
+
+    # The total number of pages the API has for the requested type
+    @property
+    def page_count(self):
+        return self.paging['PageCount']
+
+    # Yields the items of the page in batches written one after another (See
+    # StreamedPage), a decoded page is a single batch
+    def batches(self):
+        yield self
+
+    # A decoded page holds no response, See StreamedPage.close
+    def close(self):
+        pass
+
+
+class StreamedPage:
+    """StreamedPage is a page of a type whose items are decoded from its
+    response as it is read (See streaming.py). batches yields them as Pages
+    of at most batch_size items, filtered as make_page filters a page, so
+    only one batch of the page is decoded at a time. The paging metadata
+    is only known once every batch was read. response is the streamed
+    response the chunks are read from, if any, closed by close. size is
+    the bytes of the response body, when known before it is read.
+    """
+
+    def __init__(self,
+                 cls,
+                 number,
+                 chunks,
+                 since=None,
+                 batch_size=100,
+                 response=None,
+                 size=None):
+        self.cls = cls
+        self.number = number
+        self.parser = streaming.ResponseParser(chunks)
+        self.since = since
+        self.batch_size = batch_size
+        self.response = response
+        self.size = size
+        self.paging = None
+
+    # Items the page holds in memory at once, one batch of a full page
+    @property
+    def items_held(self):
+        return min(self.batch_size, int(config.PAGE_SIZE))
+
+    # Estimated bytes the page holds in memory until written, one batch's
+    # share of its response body, or None
+    @property
+    def memory(self):
+        if self.size is None:
+            return None
+        return int(self.size * DECODED_SIZE_FACTOR * self.items_held /
+                   int(config.PAGE_SIZE))
+
+    def batches(self):
+        decoding = 0.0
+        items = []
+        start = time.perf_counter()
+        for item in self.parser.items():
+            items.append(item)
+            if len(items) >= self.batch_size:
+                decoding += time.perf_counter() - start
+                yield self.batch(items)
+                items = []
+                start = time.perf_counter()
+        decoding += time.perf_counter() - start
+        metrics.stats.record(self.cls.__name__, 'decode', decoding)
+        self.paging = self.parser.response.get('Paging')
+        self.cls.check_paging(self.paging)
+        if items:
+            yield self.batch(items)
+
+    def batch(self, items):
+        return Page(
+            self.number, {
+                'Paging': self.paging,
+                'Items': self.cls.filter_items(items, self.since)
+            })
+
+    # Release the connection of the response, whether or not its body was
+    # read. Must be called once the page is written or dropped, otherwise a
+    # page whose write failed before reading it holds its pooled connection
+    # forever (See api.py)
+    def close(self):
+        if self.response is not None:
+            self.response.close()
+
+
 class IIQ_Datatype:
     """IIQ_Datatype is the base class from which all created
     IncidentIQ datatypes inherit from. It defines methods 
@@ -41,31 +299,181 @@ class IIQ_Datatype:
     and transform data from the IncidentIQ API.
     """
 
+    # Compile the extractor of every subclass once, when the class is
+    # created. Every name in fields is looked up at the first level of the
+    # returned JSON, since columns are named exactly as they appear in the
+    # JSON. Nested fields are declared in paths, which take precedence.
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if 'fields' in cls.__dict__:
+            mapping = {field: (field,) for field in cls.fields}
+            mapping.update(cls.__dict__.get('paths', {}))
+            cls.extract = staticmethod(compile_extractor(mapping))
+
     # Validator ensures empty strings are entered as null and
     # strings never exceed the capacity imposed by multi-database support.
-    # The smallest VARCHAR type we support is 4,000 characters due to
-    # ORACLE DB. There is probably no good reason for any asset to have a
-    # string this long in the database
+    # See validate_value
     def validate_inserts(self, key, value):
-        if isinstance(value, str) and value == '':
-            return None    # Set empty string to None (Null in databases)
-        elif isinstance(value, str) and len(value) >= config.STRING_LENGTH:
-            return value[0:config.STRING_LENGTH - 1]    # Truncate the string
+        return validate_value(value)
+
+    # Whether page_request accepts a since watermark, requesting only
+    # records modified at or after it (See incremental syncs in main.py)
+    incremental = False
+
+    # Given a page number, returns the API request for that page as a tuple
+    # of (method, path, payload). Types which are incremental also take a
+    # since watermark. The request is made by get_data_request, or by any
+    # other fetch engine (See async_engine.py).
+    @staticmethod
+    def page_request(page_number):
+        raise NotImplementedError("page_request API Request not implemented")
+
+    # Given a page number, returns the entire page response from the API. A
+    # streamed response is returned before its body is read
+    @classmethod
+    def get_data_request(cls, page_number, since=None, stream=False):
+        if since is None:
+            method, path, payload = cls.page_request(page_number)
         else:
-            return value
+            method, path, payload = cls.page_request(page_number, since)
+        # Request over the shared session, raises on anything but success
+        return api.request(method, path, data=payload, stream=stream)
 
-    # Given a page number, returns the entire page response from the API
+    # The filter added to the POST payload Filters of page_request to
+    # request only records modified at or after the since watermark
     @staticmethod
-    def get_data_request(page_number):
-        raise NotImplementedError(
-            "__get_data_request API Request not implemented")
+    def modified_since_filter(since):
+        return {"Facet": "ModifiedDate", "Operator": ">=", "Value": since}
 
-    # Returns the number of pages the API has for the calling type
+    # The filter added to the POST payload Filters of page_request to
+    # request only records modified at or before until
     @staticmethod
-    def get_num_pages():
-        raise NotImplementedError("get_num_pages not impelmeneted")
+    def modified_until_filter(until):
+        return {"Facet": "ModifiedDate", "Operator": "<=", "Value": until}
+
+    # Upper bound of the CreatedDate of records synced, snapshotted once when
+    # a sync starts (See main.py). Records created while syncing are left out
+    # of the sync, they only cannot shift records across page boundaries
+    # where page_request orders by creation (Eg. Ticket)
+    snapshot = None
 
-    # Safely Checks if the API response contains an element at the specified path.
+    # The filter added to the POST payload Filters of page_request to
+    # request only records created at or before the snapshot
+    @staticmethod
+    def created_until_filter(until):
+        return {"Facet": "CreatedDate", "Operator": "<=", "Value": until}
+
+    # Whether the API is known to accept created_until_filter for the type.
+    # Otherwise the snapshot is only applied client side by filter_items, so
+    # a full sync never sends a filter the API could reject
+    snapshot_filter = False
+
+    # Returns the filters of the POST payload of page_request, for the since
+    # watermark when passed and for the snapshot where snapshot_filter is set.
+    # Changes are bounded by the snapshot, so changes made while syncing
+    # cannot join the set being paged and shift the records after them
+    @classmethod
+    def request_filters(cls, since=None):
+        filters = []
+        if since is not None:
+            filters.append(cls.modified_since_filter(since))
+            if cls.snapshot is not None:
+                filters.append(cls.modified_until_filter(cls.snapshot))
+        if cls.snapshot_filter and cls.snapshot is not None:
+            filters.append(cls.created_until_filter(cls.snapshot))
+        return filters
+
+    # Requests a page from the API and decodes the response exactly once.
+    # Returns a Page holding both the paging metadata and the items. When
+    # since is passed, only records modified at or after it are requested.
+    # The response is archived when Archive is set, and read back from the
+    # archive rather than requested when replaying (See archive.py). The time
+    # spent waiting on the API and decoding is recorded (See metrics.py).
+    @classmethod
+    def fetch_page(cls, page_number, since=None):
+        size = None
+        if archive.replaying:
+            with metrics.stats.time(cls.__name__, 'decode'):
+                data = archive.load_page(cls.__name__, page_number)
+        else:
+            with metrics.stats.time(cls.__name__, 'http'):
+                response = cls.get_data_request(page_number, since)
+            size = len(response.content)
+            metrics.stats.record_bytes(cls.__name__, size)
+            with metrics.stats.time(cls.__name__, 'decode'):
+                data = response.json()
+            if archive.archiving():
+                archive.save_page(cls.__name__, page_number, data, since)
+        return cls.make_page(page_number, data, since, size)
+
+    # Requests a page from the API, returning a StreamedPage which decodes
+    # its items in batches of config.STREAM_BATCH_SIZE as the response is
+    # read. Pages are decoded whole by fetch_page when archiving or
+    # replaying, which need every page whole.
+    @classmethod
+    def stream_page(cls, page_number, since=None):
+        if archive.replaying or archive.archiving():
+            return cls.fetch_page(page_number, since)
+        with metrics.stats.time(cls.__name__, 'http'):
+            response = cls.get_data_request(page_number, since, stream=True)
+        return StreamedPage(cls,
+                            page_number,
+                            streaming.response_chunks(response, cls.__name__),
+                            since,
+                            config.STREAM_BATCH_SIZE,
+                            response=response,
+                            size=streaming.content_length(response))
+
+    # Creates a Page from the decoded response data of a page, checking the
+    # response is not empty and applying the since watermark. size is the
+    # bytes of the response body, when known
+    @classmethod
+    def make_page(cls, page_number, data, since=None, size=None):
+        page = Page(page_number, data, size)
+        cls.check_paging(page.paging)
+        page.items = cls.filter_items(page.items, since)
+        return page
+
+    # Cause an exception if for some reason the API returns nothing
+    @staticmethod
+    def check_paging(paging):
+        if paging is None or paging['PageSize'] <= 0:
+            raise HTTPError("No elements were returned from a request")
+
+    # Drop any record older than the watermark or created after the
+    # snapshot, and when since is passed any modified after the snapshot,
+    # should the filters not be applied by the API. Undated records are kept
+    @classmethod
+    def filter_items(cls, items, since=None):
+        threshold = parse_date(since)
+        until = parse_date(cls.snapshot) if cls.incremental else None
+        if threshold is None and until is None:
+            return items
+        filtered = []
+        for item in items:
+            modified = parse_date(item.get('ModifiedDate'))
+            created = parse_date(item.get('CreatedDate'))
+            if threshold is not None and modified is not None and (
+                    modified < threshold or
+                    until is not None and modified > until):
+                continue
+            if until is not None and created is not None and created > until:
+                continue
+            filtered.append(item)
+        return filtered
+
+    # Returns the number of pages the API has for the calling type
+    @classmethod
+    def get_num_pages(cls):
+        return cls.fetch_page(0).page_count
+
+    # Sets every field of a mapped instance from one decoded API item, using
+    # the extractor compiled for the class
+    def set_fields(self, item):
+        for key, value in self.extract(item).items():
+            setattr(self, key, value)
+
+    # Safely Checks if a Namespace decoded response contains an element at the specified path.
     # Takes an unlimited number of arguments, each successive argument
     # corrosponding to a successive level of nesting in the returned JSON
     # Eg. _lookup_api_contents(data, 'Address', 'Street1')
@@ -88,17 +496,16 @@ class IIQ_Datatype:
         return None
 
     # Retrieves a page of items from the API, and creates an appropriate mapped
-    # instance for all items. Returns a list of created objects.
+    # instance for all items. Returns a list of created objects. An already
+    # fetched Page (Eg. page 0 from counting pages) can be passed in to avoid
+    # requesting it again.
     @classmethod
-    def get_page(cls, page_number):
+    def get_page(cls, page_number, page=None):
         iiq_classes = []
         # Retreive the API data from the calling class
-        response = cls.get_data_request(page_number)
-
-        # Namespace hack of the response, nicely puts JSON data into objects so fields can be accessed
-        # in the form user.Name user.LocationId etc etc intead of lame indexing Eg user['Name']
-        response_types = response.json(
-            object_hook=lambda d: Namespace(**d)).Items
+        if page is None:
+            page = cls.fetch_page(page_number)
+        response_types = page.items
 
         # Iterate over every returned elmeent in the response and instantiate
         # an instance of each respective class. Add the instance to a list so we can
@@ -118,6 +525,34 @@ class IIQ_Datatype:
 
         return iiq_classes
 
+    # Transforms a decoded Page into plain row dicts, without instantiating
+    # any mapped objects. Returns a dict of Table -> list of rows, one entry
+    # for the table of the calling class and one for its custom fields table
+    # if it has one. Every row of a table has the same keys so rows can be
+    # inserted with a single executemany.
+    @classmethod
+    def get_rows(cls, page):
+        # Extracted fields which are columns of the table (Eg. Ticket
+        # extracts a UserId which is not stored)
+        table_columns = cls.__table__.columns
+        columns = [column for column in cls.extract({}) if column in table_columns]
+        rows = []
+        custom_rows = []
+        for item in page.items:
+            values = cls.extract(item)
+            rows.append({column: validate_value(values[column])
+                         for column in columns})
+
+            # Rows of the custom fields, in the layout of their table
+            if (hasattr(cls, 'custom_fields') and
+                    item.get('CustomFieldValues') is not None):
+                custom_rows.extend(cls.get_custom_type().get_rows(item))
+
+        rows_by_table = {cls.__table__: rows}
+        if custom_rows:
+            rows_by_table[cls.get_custom_type().__table__] = custom_rows
+        return rows_by_table
+
     # Retrieve the sublcass of IIQ_CustomFields (in custom_fields.py)
     # which corrosponds to the type of the calling class.
     # EG Asset.get_custom_type() returns AssetCustomFields
@@ -125,28 +560,39 @@ class IIQ_Datatype:
     def get_custom_type():
         raise NotImplementedError("get_custom_type not implemeneted")
 
-    # Retrieves the custom field values from an 'Item' of the API response Namespace
+    # Retrieves the custom field values from an 'Item' of the decoded API response
     # Returns an instance of the appropriate custom_field type for the Item or None
     # if the Item had no custom fields
     @classmethod
     def _get_custom_fields(cls, item):
-        if hasattr(cls, 'custom_fields') and hasattr(item, 'CustomFieldValues'):
+        attributes = cls._get_custom_attributes(item)
+        if attributes is not None:
+            # Create an object consisting of the datatype
+            Custom_Type = cls.get_custom_type()
+            return Custom_Type(item[Custom_Type.primarykey_name],
+                               cls.custom_fields, attributes)
+        else:
+            return None
+
+    # Retrieves the custom field values from an 'Item' of the decoded API response
+    # as a dict of [FieldName] -> [Value], or None if the Item had no custom fields
+    @classmethod
+    def _get_custom_attributes(cls, item):
+        if hasattr(cls, 'custom_fields') and item.get('CustomFieldValues') is not None:
 
             # A list of attributes to set in the form ['Name'] -> ['Value']
             attributes = {}
-            returned_fields = item.CustomFieldValues    # Nest into custom field values
+            returned_fields = item['CustomFieldValues']    # Nest into custom field values
+            custom_fields = cls.custom_fields
 
             # Iterate over every returned custom field for the object
             # When a custom filed type id is in the defined custom_fields
             # for the class, add it to the attributes dict [FieldName] -> [Value]
             for f in returned_fields:
-                if f.CustomFieldTypeId in cls.custom_fields:
-                    attributes[cls.custom_fields[f.CustomFieldTypeId]] = f.Value
-            # Create an object consisting of the datatype
-            Custom_Type = cls.get_custom_type()
-            new_custom = Custom_Type(getattr(item, Custom_Type.primarykey_name),
-                                     cls.custom_fields, attributes)
+                field_id = f['CustomFieldTypeId']
+                if field_id in custom_fields:
+                    attributes[custom_fields[field_id]] = f.get('Value')
 
-            return new_custom
+            return attributes
         else:
             return None
@@ -0,0 +1,5 @@
+"""benchmarks: Micro and end-to-end benchmarks for the sync hot path
+
+Run each benchmark as a module from the repository root, Eg.
+python -m benchmarks.bench_extractors
+"""
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""bench_adaptive.py: Fixed against adaptive concurrency on a throttled API
+
+Starts a local stand-in for the IncidentIQ API which answers after a
+fixed latency, but throttles any request beyond capacity in flight with
+a 429. Every page is fetched with a pool of threads, once with every
+thread requesting at will and once with the AIMD controller finding the
+concurrency the stand-in sustains, and reports pages/sec, 429s and the
+concurrency settled on. Requires a config.ini as for a sync, no requests
+are made to the configured instance.
+
+Usage: python -m benchmarks.bench_adaptive [pages] [latency ms] [threads] [capacity]
+Eg. python -m benchmarks.bench_adaptive 1000 100 60 15
+"""
+
+import concurrent.futures
+import sys
+import threading
+import time
+import adaptive
+import config
+import retry
+from benchmarks.bench_fetch import StandInServer, BenchType
+
+
+# Fetch every page with a pool of threads, returns pages/sec
+def run(name, server, pages, threads):
+    retry.stats = retry.RetryStats()
+    server.throttled = 0
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        fetched = list(executor.map(BenchType.fetch_page, range(pages)))
+    elapsed = time.perf_counter() - start
+    print("%-18s %10.1f pages/sec (%d pages in %.3f s, %d throttled)" %
+          (name, len(fetched) / elapsed, len(fetched), elapsed,
+           server.throttled))
+    return len(fetched) / elapsed
+
+
+if __name__ == '__main__':
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    latency = (int(sys.argv[2]) if len(sys.argv) > 2 else 100) / 1000
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else 60
+    capacity = int(sys.argv[4]) if len(sys.argv) > 4 else 15
+
+    server = StandInServer(pages, latency, capacity)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    config.IIQ_SCHEME = 'http'
+    config.IIQ_INSTANCE = '127.0.0.1:%d' % server.server_address[1]
+    config.THREADS = str(threads)    # Size of the shared session's pool
+    # Retry throttled requests quickly, as a sync would eventually
+    retry.policy = retry.RetryPolicy(retries=100,
+                                     backoff=latency,
+                                     max_backoff=latency * 10)
+
+    try:
+        adaptive.controller = None
+        fixed = run("fixed (%d)" % threads, server, pages, threads)
+        adaptive.controller = adaptive.AIMDController(threads)
+        tuned = run("adaptive (<= %d)" % threads, server, pages, threads)
+        print(adaptive.controller.report())
+        print("speedup            %10.2fx" % (tuned / fixed))
+    finally:
+        server.shutdown()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""bench_fetch.py: Page fetch throughput of the threads and async engines
+
+Starts a local stand-in for the IncidentIQ API which answers every page
+request after a fixed latency, then fetches and decodes every page once
+with a ThreadPoolExecutor making blocking requests over the shared
+session (the threads Engine) and once with the async Engine, and reports
+pages/sec for each. Pages are not written to a database. Requires a
+config.ini as for a sync, no requests are made to the configured
+instance.
+
+Usage: python -m benchmarks.bench_fetch [pages] [latency ms] [threads] [concurrency]
+Eg. python -m benchmarks.bench_fetch 2000 200 30 500
+"""
+
+import asyncio
+import concurrent.futures
+import json
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import api
+import async_engine
+import config
+from base import Page
+
+ITEMS_PER_PAGE = 100
+
+
+class StandInServer(ThreadingHTTPServer):
+    """StandInServer answers any request with the same page of synthetic
+    items after latency seconds, like a slow IncidentIQ instance. When
+    capacity is passed, requests beyond capacity in flight are throttled
+    with a 429 like a rate limited instance.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, pages, latency, capacity=None):
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.latency = latency
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.inflight = 0
+        self.throttled = 0
+        self.body = json.dumps({
+            'Paging': {
+                'PageCount': pages,
+                'PageSize': ITEMS_PER_PAGE
+            },
+            'Items': [{
+                'Id': index,
+                'Name': 'Item %d' % index
+            } for index in range(ITEMS_PER_PAGE)]
+        }).encode()
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'    # Keep connections alive
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            throttled = (server.capacity is not None and
+                         server.inflight >= server.capacity)
+            if throttled:
+                server.throttled += 1
+            else:
+                server.inflight += 1
+        if throttled:
+            self.send_response(429)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        time.sleep(server.latency)
+        with server.lock:
+            server.inflight -= 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(server.body)))
+        self.end_headers()
+        self.wfile.write(server.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BenchType:
+    """BenchType requests pages of the stand-in server the way an
+    IIQ_Datatype requests pages of the IncidentIQ API.
+    """
+
+    @staticmethod
+    def page_request(page_number):
+        return "GET", "/bench?$p=%d" % page_number, None
+
+    @classmethod
+    def make_page(cls, page_number, data, since=None, size=None):
+        return Page(page_number, data, size)
+
+    @classmethod
+    def fetch_page(cls, page_number, since=None):
+        response = api.request(*cls.page_request(page_number))
+        return cls.make_page(page_number, response.json(), since,
+                             len(response.content))
+
+
+# Fetch every page with a pool of threads, returns pages/sec
+def run_threads(pages, threads):
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        fetched = list(executor.map(BenchType.fetch_page, range(pages)))
+    return report("threads (%d)" % threads, len(fetched),
+                  time.perf_counter() - start)
+
+
+# Fetch every page with the async engine, returns pages/sec
+def run_async(concurrency):
+    start = time.perf_counter()
+    results = asyncio.run(
+        async_engine.run(
+            [(BenchType, None, lambda number, page: True, None, ())],
+            concurrency, 4))
+    return report("async (%d)" % concurrency,
+                  list(results.values()).count(True),
+                  time.perf_counter() - start)
+
+
+def report(name, pages, elapsed):
+    print("%-18s %10.1f pages/sec (%d pages in %.3f s)" %
+          (name, pages / elapsed, pages, elapsed))
+    return pages / elapsed
+
+
+if __name__ == '__main__':
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    latency = (int(sys.argv[2]) if len(sys.argv) > 2 else 200) / 1000
+    threads = int(sys.argv[3]) if len(sys.argv) > 3 else 30
+    concurrency = int(sys.argv[4]) if len(sys.argv) > 4 else 500
+
+    server = StandInServer(pages, latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    config.IIQ_SCHEME = 'http'
+    config.IIQ_INSTANCE = '127.0.0.1:%d' % server.server_address[1]
+    config.THREADS = str(threads)    # Size of the shared session's pool
+
+    try:
+        pooled = run_threads(pages, threads)
+        evented = run_async(concurrency)
+        print("speedup            %10.2fx" % (evented / pooled))
+    finally:
+        server.shutdown()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""bench_memory.py: Peak memory of a sync, pages decoded whole or streamed
+
+Starts FakeIIQ (See fake_iiq.py) and runs a full main.py sync from it
+into SQLite with PageSize 1000 and 30 Threads, first with every page
+decoded whole then with Streaming, then with whole pages under a
+MemoryBudget when one is passed, and reports the peak resident memory
+of each sync with its wall time, rows written and rows/sec. FakeIIQ
+answers after a latency, so every fetcher thread holds a page while the
+writers catch up, as against a real instance. With the threads engine
+a streamed response is read by a writer (See Streaming in README.md), so
+streaming trades throughput for memory as latency grows. Reads the peak memory of the sync with
+os.wait4, so runs on Linux and macOS only.
+
+Usage: python -m benchmarks.bench_memory [scale] [latency ms] [engine] [stream batch size] [memory budget MB]
+Eg. python -m benchmarks.bench_memory 2 300 threads 100 64
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.bench_sync import CONFIG, MAIN, count_rows
+from benchmarks.fake_iiq import FakeIIQ
+
+PAGE_SIZE = 1000
+THREADS = 30
+
+
+# Run main.py with the config in directory, returns the peak resident
+# memory of the sync in MB and its wall time
+def run_sync(directory):
+    start = time.perf_counter()
+    sync = subprocess.Popen([sys.executable, MAIN],
+                            cwd=directory,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    output = sync.stdout.read()
+    sync.stdout.close()
+    _, status, usage = os.wait4(sync.pid, 0)
+    sync.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+    if sync.returncode != 0:
+        print(output.decode(errors='replace'))
+        sys.exit("The sync failed with exit code %d" % sync.returncode)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 2**20 if sys.platform == 'darwin' else 2**10
+    return usage.ru_maxrss / scale, elapsed
+
+
+def run(server, engine, streaming, batch_size, budget=0):
+    directory = tempfile.mkdtemp()
+    database = os.path.join(directory, 'bench.db')
+    try:
+        with open(os.path.join(directory, 'config.ini'), 'w') as config_file:
+            config_file.write(
+                CONFIG.format(database=database,
+                              port=server.server_address[1],
+                              page_size=PAGE_SIZE,
+                              directory=directory,
+                              engine=engine,
+                              write_mode='core').replace(
+                                  'Threads: 30', 'Threads: %d' % THREADS) +
+                "Streaming: %s\nStreamBatchSize: %d\nMemoryBudget: %g\n" %
+                ('yes' if streaming else 'no', batch_size, budget))
+        peak, elapsed = run_sync(directory)
+        rows = sum(count_rows(database).values())
+        name = 'streamed' if streaming else 'whole'
+        if budget:
+            name += ' (%g MB budget)' % budget
+        print("%-24s %10.1f MB %9.3f s %9d rows %9.0f rows/sec" %
+              (name, peak, elapsed, rows, rows / elapsed))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    scale = float(sys.argv[1]) if len(sys.argv) > 1 else 1
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 300) / 1000
+    engine = sys.argv[3] if len(sys.argv) > 3 else 'threads'
+    batch_size = int(sys.argv[4]) if len(sys.argv) > 4 else 100
+    budget = float(sys.argv[5]) if len(sys.argv) > 5 else 0
+
+    server = FakeIIQ(scale=scale, latency=latency).start()
+    # Encode every page up front, so neither sync waits on it
+    for type_name, count in server.counts.items():
+        for page in range((count + PAGE_SIZE - 1) // PAGE_SIZE):
+            server.page_body(type_name, page, PAGE_SIZE)
+    print("%s, PageSize %d, %d Threads, %g ms latency, %s engine" %
+          (", ".join("%d %ss" % (count, name)
+                     for name, count in server.counts.items()), PAGE_SIZE,
+           THREADS, latency * 1000, engine))
+    try:
+        run(server, engine, False, batch_size)
+        run(server, engine, True, batch_size)
+        if budget:
+            run(server, engine, False, batch_size, budget)
+    finally:
+        server.shutdown()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""bench_startup.py: Time from start to the first page of every type
+
+Starts a local stand-in for the IncidentIQ API which answers custom field
+and page requests after a fixed latency. Reports the time taken and the
+requests made importing the models, then the time taken to load the
+custom fields of users, assets and tickets and page 0 of every type one
+request after another, against bootstrap.run requesting them all at once.
+Requires a config.ini as for a sync, no requests are made to the
+configured instance and the custom fields cache is not touched.
+
+Usage: python -m benchmarks.bench_startup [latency ms]
+Eg. python -m benchmarks.bench_startup 200
+"""
+
+import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import config
+from benchmarks.bench_fetch import StandInServer, StandInHandler
+
+# Every model synced by main.py
+MODELS = ('team', 'ticket', 'user', 'location', 'asset', 'room')
+
+
+class StartupServer(StandInServer):
+    """StartupServer answers custom field requests with a few custom fields
+    and any other request with a page of synthetic items, counting every
+    request it answers.
+    """
+
+    def __init__(self, latency):
+        super().__init__(1, latency)
+        self.RequestHandlerClass = StartupHandler
+        self.requests = 0
+        self.fields_body = json.dumps({
+            'Paging': {
+                'PageCount': 1,
+                'PageSize': 999999
+            },
+            'Items': [{
+                'CustomFieldTypeId': '00000000-0000-0000-0000-%012d' % index,
+                'CustomFieldType': {
+                    'Name': 'Field %d' % index
+                }
+            } for index in range(20)]
+        }).encode()
+
+
+class StartupHandler(StandInHandler):
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.do_GET()
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        if not self.path.startswith('/api/v1.0/custom-fields'):
+            return super().do_GET()
+        time.sleep(server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(server.fields_body)))
+        self.end_headers()
+        self.wfile.write(server.fields_body)
+
+
+# Load every custom field and first page one request after another
+def run_serial(bootstrap, types):
+    start = time.perf_counter()
+    for custom_type in bootstrap.CUSTOM_FIELDS_TYPES:
+        custom_type.get_fields(refresh=True)
+    for IIQ_Type in types:
+        bootstrap.fetch_first_page(IIQ_Type)
+    return report("serial", time.perf_counter() - start)
+
+
+# Load every custom field and first page at once with bootstrap.run
+def run_bootstrap(bootstrap, types):
+    start = time.perf_counter()
+    first_pages = bootstrap.run([(IIQ_Type, None) for IIQ_Type in types],
+                                refresh=True)
+    elapsed = time.perf_counter() - start
+    for first_page in first_pages.values():
+        if isinstance(first_page, Exception):
+            raise first_page
+    return report("bootstrap", elapsed)
+
+
+def report(name, elapsed):
+    print("%-18s %10.3f s" % (name, elapsed))
+    return elapsed
+
+
+if __name__ == '__main__':
+    latency = (int(sys.argv[1]) if len(sys.argv) > 1 else 200) / 1000
+
+    server = StartupServer(latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    config.IIQ_SCHEME = 'http'
+    config.IIQ_INSTANCE = '127.0.0.1:%d' % server.server_address[1]
+    cache = tempfile.mkdtemp()
+    config.CUSTOM_FIELDS_CACHE = os.path.join(cache, 'custom_fields_cache.json')
+
+    try:
+        start = time.perf_counter()
+        models = [importlib.import_module(name) for name in MODELS]
+        print("%-18s %10.3f s (%d requests)" %
+              ("import", time.perf_counter() - start, server.requests))
+
+        import bootstrap
+        types = [
+            getattr(model, name.capitalize())
+            for model, name in zip(models, MODELS)
+        ]
+        serial = run_serial(bootstrap, types)
+        concurrent = run_bootstrap(bootstrap, types)
+        print("speedup            %10.2fx" % (serial / concurrent))
+    finally:
+        server.shutdown()
+        shutil.rmtree(cache)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""bench_sync.py: Throughput of a full sync against the local fake API
+
+Starts FakeIIQ (See fake_iiq.py) and runs main.py in a subprocess, with a
+config.ini of its own in a temporary directory which syncs every type
+from FakeIIQ into a SQLite database. Reports, for every type, the pages
+served, the rows written to its tables, the seconds from its first page
+requested to its last page served, and its pages/sec and rows/sec, then
+the wall time of the whole sync. Neither the configured instance nor the
+config.ini of the repository are touched.
+
+Usage: python -m benchmarks.bench_sync [scale] [latency ms] [error rate] [engine] [write mode]
+Eg. python -m benchmarks.bench_sync 0.5 100 0.01 async upsert
+"""
+
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from benchmarks.fake_iiq import FakeIIQ
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                    'main.py')
+
+# Type -> tables its rows are written to
+TABLES = {
+    'Asset': ('Assets', 'AssetCustomFields'),
+    'User': ('Users', 'UserCustomFields'),
+    'Ticket': ('Tickets', 'TicketCustomFields'),
+    'Location': ('Locations',),
+    'Room': ('Rooms',),
+    'Team': ('Teams',)
+}
+
+CONFIG = """[Database]
+ConnectionString: sqlite:///{database}
+Schema:
+StringLength: 512
+
+[Tables]
+Assets: Assets
+AssetsCustomFields: AssetCustomFields
+Users: Users
+UsersCustomFields: UserCustomFields
+Locations: Locations
+Tickets: Tickets
+TicketsCustomFields: TicketCustomFields
+Rooms: Rooms
+Teams: Teams
+
+[IncidentIQ]
+Scheme: http
+Instance: 127.0.0.1:{port}
+Token: bench
+
+[General]
+PageSize: {page_size}
+Threads: 30
+Timeout: 100
+Retries: 5
+RetryBackoff: 0
+RetryMaxBackoff: 0
+CustomFieldsCache: {directory}/custom_fields_cache.json
+CustomFieldsTTL: 0
+Engine: {engine}
+Concurrency: 100
+Writers: 1
+WriteMode: {write_mode}
+BatchSize: 1000
+"""
+
+
+# Rows of every table of the SQLite database
+def count_rows(database):
+    connection = sqlite3.connect(database)
+    try:
+        return {
+            table: connection.execute('SELECT COUNT(*) FROM "%s"' %
+                                      table).fetchone()[0]
+            for tables in TABLES.values() for table in tables
+        }
+    finally:
+        connection.close()
+
+
+def report(server, rows, start, elapsed):
+    print("%-9s %7s %9s %9s %11s %11s" %
+          ("type", "pages", "rows", "seconds", "pages/sec", "rows/sec"))
+    for type_name, tables in TABLES.items():
+        pages, first, last = server.stats.get(type_name, (0, start, start))
+        written = sum(rows[table] for table in tables)
+        seconds = max(last - first, 1e-9)
+        print("%-9s %7d %9d %9.3f %11.1f %11.1f" %
+              (type_name, pages, written, seconds, pages / seconds,
+               written / seconds))
+    pages = sum(stats[0] for stats in server.stats.values())
+    written = sum(rows.values())
+    print("%-9s %7d %9d %9.3f %11.1f %11.1f" %
+          ("total", pages, written, elapsed, pages / elapsed,
+           written / elapsed))
+
+
+if __name__ == '__main__':
+    scale = float(sys.argv[1]) if len(sys.argv) > 1 else 0.25
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000
+    error_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0
+    engine = sys.argv[4] if len(sys.argv) > 4 else 'threads'
+    write_mode = sys.argv[5] if len(sys.argv) > 5 else 'core'
+    page_size = 500
+
+    server = FakeIIQ(scale=scale, latency=latency,
+                     error_rate=error_rate).start()
+    directory = tempfile.mkdtemp()
+    database = os.path.join(directory, 'bench.db')
+    with open(os.path.join(directory, 'config.ini'), 'w') as config_file:
+        config_file.write(
+            CONFIG.format(database=database,
+                          port=server.server_address[1],
+                          page_size=page_size,
+                          directory=directory,
+                          engine=engine,
+                          write_mode=write_mode))
+    print("%s, %g ms latency, %g%% errors, %s engine, %s writes" %
+          (", ".join("%d %ss" % (count, name)
+                     for name, count in server.counts.items()),
+           latency * 1000, error_rate * 100, engine, write_mode))
+
+    try:
+        start = time.perf_counter()
+        sync = subprocess.run([sys.executable, MAIN],
+                              cwd=directory,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT,
+                              text=True)
+        elapsed = time.perf_counter() - start
+        if sync.returncode != 0:
+            print(sync.stdout)
+            sys.exit("The sync failed with exit code %d" % sync.returncode)
+        report(server, count_rows(database), start, elapsed)
+    finally:
+        server.shutdown()
+        shutil.rmtree(directory)
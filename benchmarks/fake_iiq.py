@@ -0,0 +1,407 @@
+#!/usr/bin/env python
+"""fake_iiq.py: Local stand-in for the IncidentIQ API
+
+FakeIIQ answers the exact endpoints the models request (assets, users,
+tickets, locations, rooms, teams and custom fields) with generated but
+realistic records, so syncs can be benchmarked without touching a real
+instance. The number of records of every type, the latency of every
+response and the share of page requests failed with a 500 or throttled
+with a 429 are configurable. Records are generated from their index, so
+every run serves the same data, and every page is encoded once then
+served from memory. Requests served per type are counted and timed.
+
+Usage: python -m benchmarks.fake_iiq [--port PORT] [--scale SCALE] [--latency MS] [--error-rate RATE] [--throttle-rate RATE]
+Eg. python -m benchmarks.fake_iiq --port 8080 --scale 2 --latency 150
+then sync with Scheme: http and Instance: 127.0.0.1:8080 in config.ini.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Path -> type of records served, as requested by every model
+ROUTES = {
+    '/api/v1.0/assets/': 'Asset',
+    '/services/users': 'User',
+    '/api/v1.0/tickets': 'Ticket',
+    '/api/V1.0/locations': 'Location',
+    '/api/v1.0/locations/rooms': 'Room',
+    '/api/v1.0/teams/all': 'Team'
+}
+CUSTOM_FIELDS_PATH = '/api/v1.0/custom-fields'
+
+# Records of every type at a scale of 1
+COUNTS = {
+    'Asset': 20000,
+    'User': 10000,
+    'Ticket': 20000,
+    'Location': 40,
+    'Room': 800,
+    'Team': 25
+}
+# Custom fields defined for every strategy, few of them are set on a record
+CUSTOM_FIELDS = 30
+CUSTOM_FIELDS_SET = 4
+
+
+# A deterministic UUID for the index-th record of a kind of record
+def make_id(kind, index):
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, '%s/%d' % (kind, index)))
+
+
+# A date of the API format, index days and minutes after 2020-01-01
+def make_date(index):
+    return '2020-%02d-%02dT%02d:%02d:00.%03dZ' % (
+        1 + index % 12, 1 + index % 28, index % 24, index % 60, index % 1000)
+
+
+def custom_field_values(strategy, index):
+    return [{
+        'CustomFieldTypeId': make_id(strategy, field),
+        'Value': 'Value %d' % index if (index + field) % CUSTOM_FIELDS <
+        CUSTOM_FIELDS_SET else ''
+    } for field in range(CUSTOM_FIELDS)]
+
+
+def make_asset(index):
+    return {
+        'AssetId': make_id('Asset', index),
+        'SiteId': make_id('Site', 0),
+        'AssetTag': 'TAG%07d' % index,
+        'AssetTypeName': 'Device',
+        'SerialNumber': 'SN%010d' % (index * 7919),
+        'Name': 'Chromebook %d' % index,
+        'CreatedDate': make_date(index),
+        'ModifiedDate': make_date(index + 1),
+        'PurchasedDate': make_date(index),
+        'IsDeleted': False,
+        'IsTraining': False,
+        'CanOwnerManage': index % 2 == 0,
+        'CanSubmitTicket': True,
+        'HasOpenTicket': index % 9 == 0,
+        'OpenTicket': index % 3,
+        'PurchasePrice': 249.99,
+        'Status': {
+            'Name': 'In Service'
+        },
+        'Model': {
+            'Name': 'Model %d' % (index % 40),
+            'CategoryId': make_id('Category', index % 5),
+            'Category': {
+                'Name': 'Category %d' % (index % 5)
+            }
+        },
+        'OwnerId': make_id('User', index % COUNTS['User']),
+        'Owner': {
+            'Name': 'User %d' % (index % COUNTS['User']),
+            'Username': 'user%d' % (index % COUNTS['User'])
+        },
+        'LocationId': make_id('Location', index % COUNTS['Location']),
+        'Location': {
+            'Name': 'School %d' % (index % COUNTS['Location'])
+        },
+        'LocationRoom': {
+            'Name': 'Room %d' % (index % COUNTS['Room'])
+        },
+        'Notes': 'Synthetic asset' if index % 4 == 0 else '',
+        'CustomFieldValues': custom_field_values('AggregateAsset', index)
+    }
+
+
+def make_user(index):
+    return {
+        'UserId': make_id('User', index),
+        'SiteId': make_id('Site', 0),
+        'FirstName': 'First%d' % index,
+        'LastName': 'Last%d' % index,
+        'Email': 'user%d@example.org' % index,
+        'Username': 'user%d' % index,
+        'SchoolIdNumber': str(100000 + index),
+        'Grade': str(index % 12 + 1),
+        'CreatedDate': make_date(index),
+        'ModifiedDate': make_date(index + 2),
+        'IsActive': True,
+        'IsDeleted': False,
+        'IsOnline': index % 5 == 0,
+        'LocationId': make_id('Location', index % COUNTS['Location']),
+        'LocationName': 'School %d' % (index % COUNTS['Location']),
+        'RoleId': 'Student',
+        'Portal': 1,
+        'CustomFieldValues': custom_field_values('AggregateUser', index)
+    }
+
+
+def make_ticket(index):
+    return {
+        'TicketId': make_id('Ticket', index),
+        'SiteId': make_id('Site', 0),
+        'TicketNumber': str(100000 + index),
+        'Subject': 'Ticket %d' % index,
+        'IssueDescription': 'The device will not turn on. ' * (1 + index % 4),
+        'CreatedDate': make_date(index),
+        'ModifiedDate': make_date(index + 3),
+        'StartedDate': make_date(index),
+        'ClosedDate': make_date(index + 5) if index % 3 else None,
+        'IsClosed': index % 3 != 0,
+        'IsDeleted': False,
+        'IsPastDue': index % 11 == 0,
+        'Priority': 'Medium',
+        'OwnerId': make_id('User', index % COUNTS['User']),
+        'Owner': {
+            'Name': 'User %d' % (index % COUNTS['User'])
+        },
+        'ForId': make_id('User', (index + 1) % COUNTS['User']),
+        'For': {
+            'Name': 'User %d' % ((index + 1) % COUNTS['User'])
+        },
+        'Username': 'user%d' % (index % COUNTS['User']),
+        'LocationId': make_id('Location', index % COUNTS['Location']),
+        'Location': {
+            'Name': 'School %d' % (index % COUNTS['Location'])
+        },
+        'IssueId': make_id('Issue', index % 12),
+        'IsIssueConfirmed': True,
+        'Issue': {
+            'Name': 'Hardware'
+        },
+        'AssignedToUserId': make_id('User', index % 50),
+        'AssignedToUser': {
+            'Name': 'User %d' % (index % 50)
+        },
+        'WorkflowStepId': make_id('WorkflowStep', index % 6),
+        'WorkflowStep': {
+            'StepName': 'Submitted'
+        },
+        'AssignedToTeam': {
+            'TeamId': make_id('Team', index % COUNTS['Team']),
+            'TeamName': 'Team %d' % (index % COUNTS['Team'])
+        },
+        'CustomFieldValues': custom_field_values('AggregateTicket', index)
+    }
+
+
+def make_location(index):
+    return {
+        'LocationId': make_id('Location', index),
+        'SiteId': make_id('Site', 0),
+        'Name': 'School %d' % index,
+        'Abbreviation': 'S%d' % index,
+        'CreatedDate': make_date(index),
+        'ModifiedDate': make_date(index + 1),
+        'AddressId': make_id('Address', index),
+        'Address': {
+            'Street1': '%d Main St' % index,
+            'City': 'Springfield',
+            'State': 'IL',
+            'Zip': '62701',
+            'Country': 'US',
+            'Latitude': 39.78,
+            'Longitude': -89.65
+        },
+        'LocationTypeId': make_id('LocationType', 0),
+        'LocationType': {
+            'Name': 'School'
+        }
+    }
+
+
+def make_room(index):
+    return {
+        'LocationRoomId': make_id('Room', index),
+        'SiteId': make_id('Site', 0),
+        'Name': 'Room %d' % index,
+        'LocationId': make_id('Location', index % COUNTS['Location']),
+        'LocationName': 'School %d' % (index % COUNTS['Location']),
+        'IsAvailable': True,
+        'IsDeleted': False
+    }
+
+
+def make_team(index):
+    return {
+        'TeamId': make_id('Team', index),
+        'SiteId': make_id('Site', 0),
+        'TeamName': 'Team %d' % index,
+        'MembersCount': index % 10
+    }
+
+
+# Type -> generator of its index-th record
+GENERATORS = {
+    'Asset': make_asset,
+    'User': make_user,
+    'Ticket': make_ticket,
+    'Location': make_location,
+    'Room': make_room,
+    'Team': make_team
+}
+
+
+class FakeIIQ(ThreadingHTTPServer):
+    """FakeIIQ serves scale times COUNTS records of every type, answering
+    every request after latency seconds. A share error_rate of page requests
+    fail with a 500 and a share throttle_rate are throttled with a 429, at
+    random but the same for every run with the same seed. stats holds, for
+    every type, [pages served, first request, last response] as
+    perf_counter times.
+    """
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self,
+                 port=0,
+                 scale=1.0,
+                 latency=0.0,
+                 error_rate=0.0,
+                 throttle_rate=0.0,
+                 seed=0):
+        super().__init__(('127.0.0.1', port), FakeIIQHandler)
+        self.counts = {
+            name: max(1, int(count * scale))
+            for name, count in COUNTS.items()
+        }
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.pages = {}    # (type, page, size) -> encoded response body
+        self.stats = {}
+
+    # Start serving on a daemon thread, returns the server
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    # The response body of a page of a type, encoded once
+    def page_body(self, type_name, page, size):
+        key = (type_name, page, size)
+        body = self.pages.get(key)
+        if body is None:
+            total = self.counts[type_name]
+            generate = GENERATORS[type_name]
+            body = json.dumps({
+                'Items': [
+                    generate(index)
+                    for index in range(page * size, min(total, (page + 1) *
+                                                        size))
+                ],
+                'Paging': {
+                    'PageCount': (total + size - 1) // size,
+                    'PageIndex': page,
+                    'PageSize': size,
+                    'TotalRows': total
+                }
+            }).encode()
+            with self.lock:
+                self.pages[key] = body
+        return body
+
+    def fields_body(self, strategy):
+        return json.dumps({
+            'Items': [{
+                'CustomFieldTypeId': make_id(strategy, field),
+                'CustomFieldType': {
+                    'Name': '%s Field %d' % (strategy[len('Aggregate'):], field)
+                }
+            } for field in range(CUSTOM_FIELDS)],
+            'Paging': {
+                'PageCount': 1,
+                'PageSize': 999999
+            }
+        }).encode()
+
+    # The status a page request is answered with, 200, 429 or 500
+    def outcome(self):
+        with self.lock:
+            draw = self.random.random()
+        if draw < self.error_rate:
+            return 500
+        if draw < self.error_rate + self.throttle_rate:
+            return 429
+        return 200
+
+    def record(self, type_name, start):
+        with self.lock:
+            stats = self.stats.setdefault(type_name, [0, start, start])
+            stats[0] += 1
+            stats[1] = min(stats[1], start)
+            stats[2] = max(stats[2], time.perf_counter())
+
+
+class FakeIIQHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'    # Keep connections alive
+
+    def do_GET(self):
+        start = time.perf_counter()
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        time.sleep(server.latency)
+
+        if url.path == CUSTOM_FIELDS_PATH:
+            return self.respond(200, server.fields_body(body['Strategy']))
+        type_name = ROUTES.get(url.path)
+        if type_name is None:
+            return self.respond(404)
+        status = server.outcome()
+        if status != 200:
+            return self.respond(status)
+        page = int(query.get('$p', ['0'])[0])
+        size = int(query.get('$s', ['1000'])[0])
+        self.respond(200, server.page_body(type_name, page, size))
+        server.record(type_name, start)
+
+    do_POST = do_GET
+
+    def respond(self, status, body=b''):
+        self.send_response(status)
+        if status == 429:
+            self.send_header('Retry-After', '0')
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Serve a local stand-in for the IncidentIQ API")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--scale',
+                        type=float,
+                        default=1.0,
+                        help="multiplier of the records of every type")
+    parser.add_argument('--latency',
+                        type=float,
+                        default=0,
+                        help="milliseconds before every response")
+    parser.add_argument('--error-rate',
+                        type=float,
+                        default=0,
+                        help="share of page requests failed with a 500")
+    parser.add_argument('--throttle-rate',
+                        type=float,
+                        default=0,
+                        help="share of page requests throttled with a 429")
+    args = parser.parse_args()
+
+    server = FakeIIQ(args.port, args.scale, args.latency / 1000,
+                     args.error_rate, args.throttle_rate)
+    print("Serving %s on 127.0.0.1:%d" % (", ".join(
+        "%d %ss" % (count, name)
+        for name, count in server.counts.items()), server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
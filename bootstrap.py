@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""bootstrap.py: Requests what a sync needs to start, all at once
+
+Importing the models makes no requests to the IncidentIQ API. Before a
+sync starts, the custom field definitions of users, assets and tickets
+(See custom_fields.py) and page 0 of every type to sync, which holds the
+number of pages of the type, are requested at the same time on one pool
+of threads rather than one after another, so starting a sync takes about
+one round trip. Page 0 is then synced as is by either Engine rather than
+requested a second time.
+"""
+
+import concurrent.futures
+import config
+from custom_fields import UserCustomFields, AssetCustomFields, TicketCustomFields
+
+# Every custom fields type, loaded before any type is synced
+CUSTOM_FIELDS_TYPES = (UserCustomFields, AssetCustomFields, TicketCustomFields)
+
+
+# Request and decode page 0 of cls. Errors are reported before being raised.
+def fetch_first_page(cls, since=None):
+    try:
+        return cls.fetch_page(0, since)
+    except Exception as e:
+        print("A request for page 0 of %s failed" % cls.__name__, e)
+        raise e
+
+
+# Load the custom fields of every custom fields type, requesting them again
+# when refresh is set, and fetch page 0 of every type in syncs, a list of
+# (type, since) tuples, on up to workers threads at once. Returns a dict of
+# type -> its first Page, or the exception raised fetching it. Raises the
+# error of any custom fields which could not be loaded, as no custom fields
+# table can be created without them.
+def run(syncs, refresh=False, workers=None):
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers or int(config.THREADS)) as executor:
+        fields = [
+            executor.submit(custom_type.get_fields, refresh)
+            for custom_type in CUSTOM_FIELDS_TYPES
+        ]
+        first_pages = {
+            IIQ_Type: executor.submit(fetch_first_page, IIQ_Type, since)
+            for IIQ_Type, since in syncs
+        }
+    for future in fields:
+        future.result()
+    return {
+        IIQ_Type: future.exception() or future.result()
+        for IIQ_Type, future in first_pages.items()
+    }
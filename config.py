@@ -18,6 +18,10 @@ SCHEMA = cf.get(
         'Database',
         'Schema').strip()) > 0 else None    # Assign to none if schema is blank
 STRING_LENGTH = int(cf.get('Database', 'StringLength'))
+# What becomes of the column of a custom field removed from IncidentIQ,
+# 'deprecate' (kept and recorded in SyncSchema), 'keep' or 'drop'
+REMOVED_COLUMNS = cf.get('Database', 'RemovedColumns',
+                         fallback='deprecate').strip().lower()
 # Table Names
 ASSETS_TABLE_NAME = cf.get('Tables', 'Assets')
 ASSETS_CF_TABLE_NAME = cf.get('Tables', 'AssetsCustomFields')
@@ -28,10 +32,72 @@ TICKETS_TABLE_NAME = cf.get('Tables', 'Tickets')
 TICKETS_CF_TABLE_NAME = cf.get('Tables', 'TicketsCustomFields')
 ROOMS_TABLE_NAME = cf.get('Tables', 'Rooms')
 TEAMS_TABLE_NAME = cf.get('Tables', 'Teams')
+SYNC_STATE_TABLE_NAME = cf.get('Tables', 'SyncState', fallback='SyncState')
+SYNC_RUNS_TABLE_NAME = cf.get('Tables', 'SyncRuns', fallback='SyncRuns')
+SYNC_CHECKPOINTS_TABLE_NAME = cf.get('Tables',
+                                     'SyncCheckpoints',
+                                     fallback='SyncCheckpoints')
+SYNC_SCHEMA_TABLE_NAME = cf.get('Tables', 'SyncSchema', fallback='SyncSchema')
 # Incident IQ Credentials
 IIQ_INSTANCE = cf.get('IncidentIQ', 'Instance')
 IIQ_TOKEN = cf.get('IncidentIQ', 'Token')
+# Scheme of the IncidentIQ instance, http only for a local stand-in
+IIQ_SCHEME = cf.get('IncidentIQ', 'Scheme', fallback='https')
 # General configuration
 PAGE_SIZE = cf.get('General', 'PageSize')
 THREADS = cf.get('General', 'Threads')
 TIMEOUT = int(cf.get('General', 'Timeout'))
+# Max number of times a request is retried after a 429, 5xx or timeout
+RETRIES = int(cf.get('General', 'Retries', fallback='5'))
+# Base and max seconds waited before a retry, doubled on every retry
+RETRY_BACKOFF = float(cf.get('General', 'RetryBackoff', fallback='1'))
+RETRY_MAX_BACKOFF = float(cf.get('General', 'RetryMaxBackoff', fallback='60'))
+# Whether the number of requests in flight adapts to the API, up to Threads
+# (or Concurrency with the async Engine), See adaptive.py
+ADAPTIVE = cf.getboolean('General', 'Adaptive', fallback=False)
+# File caching custom field definitions, and seconds before they are stale
+CUSTOM_FIELDS_CACHE = cf.get('General',
+                             'CustomFieldsCache',
+                             fallback='custom_fields_cache.json')
+CUSTOM_FIELDS_TTL = int(cf.get('General', 'CustomFieldsTTL', fallback='86400'))
+# Directory every fetched page is archived to, or blank not to archive them
+# (See archive.py)
+ARCHIVE = cf.get('General', 'Archive', fallback='').strip()
+# Files the JSON report and the Prometheus textfile of every sync are written
+# to, or blank not to write them (See metrics.py)
+REPORT = cf.get('General', 'Report', fallback='').strip()
+METRICS = cf.get('General', 'Metrics', fallback='').strip()
+# How pages are fetched, 'threads' (a worker thread per page request) or
+# 'async' (many requests on one event loop, See async_engine.py)
+ENGINE = cf.get('General', 'Engine', fallback='threads').strip().lower()
+# Max number of page requests in flight at a time with the async Engine
+CONCURRENCY = int(cf.get('General', 'Concurrency', fallback='100'))
+# Number of threads writing pages to the database, and so of connections
+WRITERS = int(cf.get('General', 'Writers', fallback='4'))
+# Max number of fetched pages waiting for a writer with the threads Engine
+QUEUE_SIZE = int(cf.get('General', 'QueueSize', fallback=str(WRITERS * 2)))
+# Max number of pages fetched but not yet written at once, and max estimated
+# MB of memory they hold, 0 for no limit (threads Engine, See pipeline.py)
+PAGES_IN_FLIGHT = int(cf.get('General', 'PagesInFlight', fallback='0'))
+MEMORY_BUDGET = float(cf.get('General', 'MemoryBudget', fallback='0'))
+# Max number of pages of a type fetched at once, by lower case type name
+# Eg. {'ticket': 10}. Types without a cap may use every thread
+TYPE_CONCURRENCY = {
+    name: int(value) for name, value in cf.items('TypeConcurrency')
+} if cf.has_section('TypeConcurrency') else {}
+# Layout of the custom fields table of a type, by lower case type name
+# Eg. {'asset': 'long'}. Types not listed use the 'wide' layout
+CUSTOM_FIELD_LAYOUTS = {
+    name: value.strip().lower()
+    for name, value in cf.items('CustomFieldLayout')
+} if cf.has_section('CustomFieldLayout') else {}
+# How pages are written to the database, 'orm', 'core' (bulk insert) or
+# 'upsert' (bulk insert or update by primary key)
+WRITE_MODE = cf.get('General', 'WriteMode', fallback='orm').strip().lower()
+# Whether the items of a page are decoded and written in batches of
+# StreamBatchSize as the response is read, rather than all at once (See
+# streaming.py)
+STREAMING = cf.getboolean('General', 'Streaming', fallback=False)
+STREAM_BATCH_SIZE = int(cf.get('General', 'StreamBatchSize', fallback='100'))
+# Max number of rows sent to the database in one executemany
+BATCH_SIZE = int(cf.get('General', 'BatchSize', fallback='1000'))
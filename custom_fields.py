@@ -9,25 +9,147 @@ mapped dynamically with create_table based on an API call which retreives
 the custom fields for each IncidentIQ type. Once mapped, subclasses of
 IIQ_CustomFields operate just like an other IncidentIQ type, objects are
 instantiated and inserted into a database with an SqlAlchemy Session.
+
+Custom field definitions rarely change, so they are cached on disk in
+config.CUSTOM_FIELDS_CACHE keyed by IncidentIQ instance and strategy, and
+reused for config.CUSTOM_FIELDS_TTL seconds. Within a run the definitions
+of a type are fetched at most once, by get_fields, into the
+field_definitions dict of its class. The same dict is the custom_fields
+attribute of the type (Eg. Asset.custom_fields), so importing a type makes
+no requests, its custom fields are filled in before the sync starts (See
+bootstrap.py).
+
+Custom fields are sparse, most items have a value for few of them. The
+table of a type is created in one of three layouts, selected per type
+in the [CustomFieldLayout] section of config.ini:
+
+ * wide, a row per item with a column per custom field (the default)
+ * long, a row per item and custom field with a value, keyed by the
+   item and the field's UUID, holding the field's name and value
+ * json, a row per item holding every custom field with a value as one
+   JSON object, in a native JSON column where the dialect has one
 """
 
-from sqlalchemy import Column, String, Integer, Date, Table
+from sqlalchemy import Column, String, Integer, Date, Table, Text
+from sqlalchemy.types import TypeDecorator
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy_utils.types.uuid import UUIDType as UNIQUEIDENTIFIER
 from sqlalchemy.orm.mapper import validates
 from sqlalchemy.orm import mapper
-import requests
-from requests.models import HTTPError
 import json
+import os
+import threading
+import time
 
 from sqlalchemy.sql.expression import all_
-from base import Base, IIQ_Datatype
+from base import Base, IIQ_Datatype, validate_value
 import config
+import api
+import archive
+
+_cache_lock = threading.Lock()
+
+# Every layout the table of a type's custom fields can be created in
+LAYOUTS = ('wide', 'long', 'json')
+
+
+class JSONDocument(TypeDecorator):
+    """JSONDocument is a column holding a JSON document, written as an
+    already serialized string. Created as the native JSON type on
+    PostgreSQL (JSONB) and MySQL / MariaDB, and as a string type which the
+    JSON functions of the database accept everywhere else.
+    """
+    impl = Text
+    cache_ok = True
+
+
+@compiles(JSONDocument, 'postgresql')
+def compile_jsonb(type_, compiler, **kw):
+    return "JSONB"
+
+
+@compiles(JSONDocument, 'mysql')
+@compiles(JSONDocument, 'mariadb')
+def compile_json(type_, compiler, **kw):
+    return "JSON"
+
+
+@compiles(JSONDocument, 'mssql')
+def compile_nvarchar(type_, compiler, **kw):
+    return "NVARCHAR(max)"
+
+
+# Returns the Table of custom fields, a dict of 'Field UUID' -> 'Field Name',
+# for items keyed by primarykey_name, in layout
+def make_table(table_name, primarykey_name, fields, layout='wide',
+               metadata=Base.metadata):
+    key = Column(primarykey_name,
+                 UNIQUEIDENTIFIER(binary=False),
+                 primary_key=True)
+    if layout == 'wide':
+        columns = [
+            Column(field_name, String(length=config.STRING_LENGTH))
+            for field_name in list(fields.values())
+        ]
+    elif layout == 'long':
+        columns = [
+            Column('FieldId', UNIQUEIDENTIFIER(binary=False),
+                   primary_key=True),
+            Column('FieldName', String(length=config.STRING_LENGTH)),
+            Column('Value', String(length=config.STRING_LENGTH))
+        ]
+    elif layout == 'json':
+        columns = [Column('Fields', JSONDocument)]
+    else:
+        raise ValueError("Unknown custom field layout %s, expected one of %s"
+                         % (layout, ", ".join(LAYOUTS)))
+    return Table(table_name,
+                 metadata,
+                 key,
+                 *columns,
+                 schema=config.SCHEMA)
+
+
+# Returns the dict of cache key -> {'Fetched': epoch seconds, 'Fields':
+# {'Field UUID': 'Field Name'}} stored on disk, empty if there is none
+def read_cache():
+    try:
+        with open(config.CUSTOM_FIELDS_CACHE) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+
+# Store the fields of a cache key on disk, keeping every other key. The file
+# is replaced atomically so a concurrent reader never sees it half written
+def write_cache(key, fields):
+    with _cache_lock:
+        cache = read_cache()
+        cache[key] = {'Fetched': time.time(), 'Fields': fields}
+        temporary = config.CUSTOM_FIELDS_CACHE + '.tmp'
+        try:
+            with open(temporary, 'w') as cache_file:
+                json.dump(cache, cache_file)
+            os.replace(temporary, config.CUSTOM_FIELDS_CACHE)
+        except OSError as e:
+            # The cache is an optimisation, a sync never fails over it
+            print("Could not write the custom fields cache", e)
 
 
 class IIQ_CustomFields(object):
     # A custom fields class which allows for the dynamic deffinition
     # of fields given the API response
 
+    # Every subclass holds its own custom fields, formatted
+    # 'Field UUID' -> 'Field Name', empty until get_fields is called
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.field_definitions = {}
+        cls.fields_loaded = False
+
+    # Layout of the table, set by create_table
+    layout = 'wide'
+
     # Validator ensures empty strings are entered as null and
     # strings never exceed the capacity imposed by multi-database support.
     # The smallest VARCHAR type we support is 4,000 characters due to
@@ -35,12 +157,7 @@ class IIQ_CustomFields(object):
     # string this long in the database. Strings longer than 4,000 characters
     # are truncated.
     def validate_inserts(self, value):
-        if isinstance(value, str) and value == '':
-            return None    # Set empty string to None (Null in databases)
-        elif isinstance(value, str) and len(value) >= config.STRING_LENGTH:
-            return value[0:config.STRING_LENGTH - 1]    # Truncate the string
-        else:
-            return value
+        return validate_value(value)
 
     # Parse out all returned custom field types from the API
     # This should be the same for all types of custom fields
@@ -74,58 +191,104 @@ class IIQ_CustomFields(object):
             # fields
             setattr(self, key, self.validate_inserts(attributes[key]))
 
+    # Request every custom field defined for the calling type. The type is
+    # selected by the strategy class attribute of each subclass
+    # Eg. UserCustomFields.strategy -> 'AggregateUser'
+    @classmethod
+    def get_fields_request(cls, page_number):
+        path = "/api/v1.0/custom-fields?$p=" + str(
+            page_number) + "&$s=999999"
+
+        payload = json.dumps({
+            "SiteScope": "Aggregate",
+            "Strategy": cls.strategy
+        })
+
+        # Request over the shared session, raises on anything but success
+        return api.request("POST", path, data=payload)
+
+    # Returns the custom fields of the calling type, field_definitions. Served
+    # from memory once loaded in this run, otherwise from the disk cache while
+    # it is younger than config.CUSTOM_FIELDS_TTL, otherwise requested from
+    # the API. refresh always requests them. When replaying they are read from
+    # the archive (See archive.py). field_definitions is updated in place, so
+    # every reference to it sees the loaded fields.
+    @classmethod
+    def get_fields(cls, refresh=False):
+        if cls.fields_loaded and not refresh:
+            return cls.field_definitions
+
+        key = config.IIQ_INSTANCE + '|' + cls.strategy
+        cached = None if refresh else read_cache().get(key)
+        if archive.replaying:
+            fetched = archive.load_fields(cls.strategy)
+        elif cached is not None and time.time(
+        ) - cached['Fetched'] < config.CUSTOM_FIELDS_TTL:
+            fetched = cached['Fields']
+        else:
+            fetched = cls.parse_fields(cls.get_fields_request(0))
+            write_cache(key, fetched)
+        if archive.archiving():
+            archive.save_fields(cls.strategy, fetched)
+
+        cls.field_definitions.clear()
+        cls.field_definitions.update(fetched)
+        cls.fields_loaded = True
+        return cls.field_definitions
+
     # Create and map the custom field type table to the ORM.
     # After the creation of this table, the base class [Users/Assets/etc]CustomFields can
     # be populated with the API fields data
     @classmethod
-    def create_table(cls, table_name, primarykey_name):
-        #response = cls.get_fields_request(0)
-        all_fields = cls.parse_fields(cls.get_fields_request(0))
-        t = Table(table_name,
-                  Base.metadata,
-                  Column(primarykey_name,
-                         UNIQUEIDENTIFIER(binary=False),
-                         primary_key=True),
-                  *(Column(field_name, String(length=config.STRING_LENGTH))
-                    for field_name in list(all_fields.values())),
-                  schema=config.SCHEMA)
+    def create_table(cls, table_name, primarykey_name, layout='wide'):
+        t = make_table(table_name, primarykey_name, cls.get_fields(), layout)
         mapper(cls, t)
         cls.__table__ = t
+        cls.layout = layout
+
+    # Returns the plain rows of the custom fields of one decoded API item, in
+    # the layout of the table. Items without custom fields have no rows in the
+    # long layout, a row of nulls in the wide layout and a null document in
+    # the json layout.
+    @classmethod
+    def get_rows(cls, item):
+        key = item[cls.primarykey_name]
+        fields = cls.field_definitions
+        values = {}    # 'Field UUID' -> value
+        for field in item['CustomFieldValues']:
+            field_id = field['CustomFieldTypeId']
+            if field_id in fields:
+                values[field_id] = validate_value(field.get('Value'))
+
+        if cls.layout == 'wide':
+            row = dict.fromkeys(fields.values())
+            row[cls.primarykey_name] = key
+            for field_id, value in values.items():
+                row[fields[field_id]] = value
+            return [row]
+        if cls.layout == 'long':
+            return [{
+                cls.primarykey_name: key,
+                'FieldId': field_id,
+                'FieldName': fields[field_id],
+                'Value': value
+            } for field_id, value in values.items() if value is not None]
+        document = {
+            fields[field_id]: value
+            for field_id, value in values.items()
+            if value is not None
+        }
+        return [{
+            cls.primarykey_name: key,
+            'Fields': json.dumps(document) if document else None
+        }]
 
 
 class UserCustomFields(IIQ_CustomFields):
     # UserCustomFields is a dynamicly created class which holds all custom
     # fields for the a User in IncidentIQ.
     primarykey_name = 'UserId'
-
-    @staticmethod
-    def get_fields_request(page_number):
-        url = "https://" + str(
-            config.IIQ_INSTANCE) + "/api/v1.0/custom-fields?$p=" + str(
-                page_number) + "&$s=999999"
-
-        payload = json.dumps({
-            "SiteScope": "Aggregate",
-            "Strategy": "AggregateUser"
-        })
-        headers = {
-            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.106 Safari/537.36',
-            'content-type': 'application/json',
-            'accept': 'application/json, text/plain, */*',
-            'Authorization': 'Bearer ' + config.IIQ_TOKEN
-        }
-
-        response = requests.request("POST",
-                                    url,
-                                    headers=headers,
-                                    data=payload,
-                                    timeout=config.TIMEOUT)
-        # Cause an exception if anything but success is returned
-        if response.status_code != 200:
-            raise HTTPError("""A request returned a status code other than 200\n
-            Status Code: """ + str(response.status_code))
-
-        return response
+    strategy = 'AggregateUser'
 
     def __init__(self, asset_id, fields, attributes):
         super().__init__(self.primarykey_name, asset_id, fields, attributes)
@@ -135,34 +298,7 @@ class AssetCustomFields(IIQ_CustomFields):
     # AssetCustomFields is a dynamically created class which holds all custom
     # fields for an Asset in IncidentIQ
     primarykey_name = 'AssetId'
-
-    def get_fields_request(page_number):
-        url = "https://" + str(
-            config.IIQ_INSTANCE) + "/api/v1.0/custom-fields?$p=" + str(
-                page_number) + "&$s=999999"
-
-        payload = json.dumps({
-            "SiteScope": "Aggregate",
-            "Strategy": "AggregateAsset"
-        })
-        headers = {
-            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.106 Safari/537.36',
-            'content-type': 'application/json',
-            'accept': 'application/json, text/plain, */*',
-            'Authorization': 'Bearer ' + config.IIQ_TOKEN
-        }
-
-        response = requests.request("POST",
-                                    url,
-                                    headers=headers,
-                                    data=payload,
-                                    timeout=config.TIMEOUT)
-        # Cause an exception if anything but success is returned
-        if response.status_code != 200:
-            raise HTTPError("""A request returned a status code other than 200\n
-            Status Code: """ + str(response.status_code))
-
-        return response
+    strategy = 'AggregateAsset'
 
     def __init__(self, asset_id, fields, attributes):
         super().__init__(self.primarykey_name, asset_id, fields, attributes)
@@ -172,35 +308,7 @@ class TicketCustomFields(IIQ_CustomFields):
     # TicketCustomFields is a dynamicly created class which holds all custom
     # fields for a Ticket in IncidentIQ.
     primarykey_name = 'TicketId'
-
-    @staticmethod
-    def get_fields_request(page_number):
-        url = "https://" + str(
-            config.IIQ_INSTANCE) + "/api/v1.0/custom-fields?$p=" + str(
-                page_number) + "&$s=999999"
-
-        payload = json.dumps({
-            "SiteScope": "Aggregate",
-            "Strategy": "AggregateTicket"
-        })
-        headers = {
-            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.106 Safari/537.36',
-            'content-type': 'application/json',
-            'accept': 'application/json, text/plain, */*',
-            'Authorization': 'Bearer ' + config.IIQ_TOKEN
-        }
-
-        response = requests.request("POST",
-                                    url,
-                                    headers=headers,
-                                    data=payload,
-                                    timeout=config.TIMEOUT)
-        # Cause an exception if anything but success is returned
-        if response.status_code != 200:
-            raise HTTPError("""A request returned a status code other than 200\n
-            Status Code: """ + str(response.status_code))
-
-        return response
+    strategy = 'AggregateTicket'
 
     def __init__(self, asset_id, fields, attributes):
         super().__init__(self.primarykey_name, asset_id, fields, attributes)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+"""loaders.py: Dialect specific bulk loading of rows
+
+A Loader inserts a list of row dicts into a table over an open
+connection, using the fastest bulk path available for the database
+in use. get_loader picks the Loader for an engine's dialect and driver:
+
+ * PostgreSQL (psycopg2) streams rows with COPY FROM STDIN
+ * MySQL / MariaDB send batched multi-row INSERT ... VALUES statements
+ * Microsoft SQL Server (pyodbc) uses executemany with fast_executemany
+   enabled on the engine (See engine_options)
+ * Oracle (cx_Oracle) uses executemany, which cx_Oracle sends as array binds
+ * Anything else falls back to a generic executemany
+
+Every Loader can also upsert rows, keyed on the table's primary key, so
+a page can be written again without duplicates or integrity errors:
+
+ * PostgreSQL / SQLite use INSERT ... ON CONFLICT DO UPDATE
+ * MySQL / MariaDB use INSERT ... ON DUPLICATE KEY UPDATE
+ * Microsoft SQL Server / Oracle use MERGE
+ * Anything else deletes existing rows by primary key then inserts
+"""
+
+import csv
+import io
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+
+# Extra keyword arguments for create_engine which enable the bulk path of
+# the dialect and driver named in the connection string.
+def engine_options(connection_string):
+    scheme = connection_string.split('://', 1)[0].lower()
+    if scheme == 'mssql+pyodbc':
+        # Send executemany parameters as one array instead of a round
+        # trip for every row
+        return {'fast_executemany': True}
+    return {}
+
+
+class Loader:
+    """Loader is the generic bulk path, rows are sent with executemany in
+    batches of at most batch_size rows. Dialect specific loaders override
+    load_batch.
+    """
+    name = 'executemany'
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+
+    # Insert every row into table over connection, one batch at a time
+    def load(self, connection, table, rows):
+        for i in range(0, len(rows), self.batch_size):
+            self.load_batch(connection, table, rows[i:i + self.batch_size])
+
+    def load_batch(self, connection, table, rows):
+        connection.execute(table.insert(), rows)
+
+    # Insert every row into table over connection, updating rows which
+    # already exist with the same primary key, one batch at a time
+    def upsert(self, connection, table, rows):
+        upsert_batch = UPSERTS.get(connection.dialect.name)
+        for i in range(0, len(rows), self.batch_size):
+            batch = unique_rows(table, rows[i:i + self.batch_size])
+            if upsert_batch is not None:
+                upsert_batch(connection, table, batch)
+            else:
+                self.delete_batch(connection, table, batch)
+                self.load_batch(connection, table, batch)
+
+    # Delete the rows of table with the primary key of any of rows
+    def delete_batch(self, connection, table, rows):
+        key = primary_key(table)
+        connection.execute(table.delete().where(
+            key.in_([row[key.name] for row in rows])))
+
+    # Delete the rows of table whose column_name column holds any of keys,
+    # one batch of keys at a time. For tables with several rows per key
+    def delete_keys(self, connection, table, column_name, keys):
+        keys = list(dict.fromkeys(keys))
+        for i in range(0, len(keys), self.batch_size):
+            connection.execute(table.delete().where(
+                table.columns[column_name].in_(keys[i:i + self.batch_size])))
+
+
+# The single primary key column of a table
+def primary_key(table):
+    return list(table.primary_key.columns)[0]
+
+
+# Rows with a unique primary key, the last row of any duplicate wins. A
+# single upsert statement may not touch the same row twice on most dialects
+def unique_rows(table, rows):
+    key = primary_key(table).name
+    return list({row[key]: row for row in rows}.values())
+
+
+# INSERT ... ON CONFLICT (key) DO UPDATE, for PostgreSQL and SQLite
+def upsert_on_conflict(connection, table, rows):
+    dialect = postgresql if connection.dialect.name == 'postgresql' else sqlite
+    key = primary_key(table)
+    statement = dialect.insert(table)
+    updates = {
+        column: statement.excluded[column]
+        for column in rows[0]
+        if column != key.name
+    }
+    if updates:
+        statement = statement.on_conflict_do_update(index_elements=[key],
+                                                    set_=updates)
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=[key])
+    connection.execute(statement, rows)
+
+
+# INSERT ... ON DUPLICATE KEY UPDATE, for MySQL and MariaDB
+def upsert_on_duplicate_key(connection, table, rows):
+    key = primary_key(table)
+    statement = mysql.insert(table)
+    updates = {
+        column: statement.inserted[column]
+        for column in rows[0]
+        if column != key.name
+    }
+    # Updating the key to itself turns a duplicate into a no-op
+    statement = statement.on_duplicate_key_update(
+        updates or {key.name: statement.inserted[key.name]})
+    connection.execute(statement, rows)
+
+
+# MERGE for Microsoft SQL Server and Oracle. The statement is written as
+# text, bind parameters are typed with the table's column types so values
+# are processed exactly as they are for an insert. Parameters are named by
+# position since custom field column names are not valid bind names.
+def upsert_merge(connection, table, rows):
+    preparer = connection.dialect.identifier_preparer
+    key = primary_key(table)
+    columns = list(rows[0])
+    names = {column: 'p%d' % i for i, column in enumerate(columns)}
+    quoted = {column: preparer.quote(column) for column in columns}
+
+    # The source is a single row built from the bind parameters, aliased s
+    if connection.dialect.name == 'oracle':
+        source = "(SELECT %s FROM dual) s" % ", ".join(
+            ":%s AS %s" % (names[column], quoted[column])
+            for column in columns)
+    else:
+        source = "(VALUES (%s)) AS s (%s)" % (", ".join(
+            ":" + names[column] for column in columns), ", ".join(
+                quoted[column] for column in columns))
+
+    updates = ", ".join("t.%s = s.%s" % (quoted[column], quoted[column])
+                        for column in columns
+                        if column != key.name)
+    statement = "MERGE INTO %s t USING %s ON (t.%s = s.%s)" % (
+        preparer.format_table(table), source, quoted[key.name],
+        quoted[key.name])
+    if updates:
+        statement += " WHEN MATCHED THEN UPDATE SET " + updates
+    statement += " WHEN NOT MATCHED THEN INSERT (%s) VALUES (%s)" % (
+        ", ".join(quoted[column] for column in columns), ", ".join(
+            "s." + quoted[column] for column in columns))
+    if connection.dialect.name == 'mssql':
+        statement += ";"    # SQL Server requires MERGE to be terminated
+
+    statement = text(statement).bindparams(*(bindparam(
+        names[column], type_=table.columns[column].type)
+                                              for column in columns))
+    connection.execute(statement, [{
+        names[column]: row[column] for column in columns
+    } for row in rows])
+
+
+# Dialect name -> upsert of one batch of rows
+UPSERTS = {
+    'postgresql': upsert_on_conflict,
+    'sqlite': upsert_on_conflict,
+    'mysql': upsert_on_duplicate_key,
+    'mariadb': upsert_on_duplicate_key,
+    'mssql': upsert_merge,
+    'oracle': upsert_merge
+}
+
+
+class MultiValuesLoader(Loader):
+    """MultiValuesLoader sends every batch as one multi-row
+    INSERT ... VALUES (...), (...) statement. Used for MySQL and MariaDB.
+    """
+    name = 'multi-values'
+
+    def load_batch(self, connection, table, rows):
+        connection.execute(table.insert().values(rows))
+
+
+class ExecutemanyArrayLoader(Loader):
+    """ExecutemanyArrayLoader relies on the driver sending executemany
+    parameters as a single array. That is native for cx_Oracle array binds
+    and for pyodbc once fast_executemany is enabled on the engine, both do
+    best with large batches.
+    """
+    name = 'array-executemany'
+
+
+class PostgresCopyLoader(Loader):
+    """PostgresCopyLoader streams every batch into the table with
+    COPY ... FROM STDIN as CSV, over the DBAPI connection of the current
+    transaction. None is written as an unquoted empty field, which COPY
+    reads as NULL.
+    """
+    name = 'copy'
+
+    def load_batch(self, connection, table, rows):
+        columns = list(rows[0].keys())
+        preparer = connection.dialect.identifier_preparer
+        statement = "COPY %s (%s) FROM STDIN WITH (FORMAT csv)" % (
+            preparer.format_table(table), ", ".join(
+                preparer.quote(column) for column in columns))
+
+        buffer = io.StringIO()
+        csv_writer = csv.writer(buffer)
+        for row in rows:
+            csv_writer.writerow([row[column] for column in columns])
+        buffer.seek(0)
+
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(statement, buffer)
+        finally:
+            cursor.close()
+
+
+# Returns the fastest Loader for the dialect and driver of engine
+def get_loader(engine, batch_size=1000):
+    dialect = engine.dialect
+    if dialect.name == 'postgresql' and dialect.driver == 'psycopg2':
+        return PostgresCopyLoader(batch_size)
+    if dialect.name in ('mysql', 'mariadb'):
+        return MultiValuesLoader(batch_size)
+    if dialect.name == 'mssql' and dialect.driver == 'pyodbc':
+        return ExecutemanyArrayLoader(batch_size)
+    if dialect.name == 'oracle':
+        return ExecutemanyArrayLoader(batch_size)
+    return Loader(batch_size)
@@ -4,7 +4,6 @@ from sqlalchemy_utils.types.uuid import UUIDType as UNIQUEIDENTIFIER
 from sqlalchemy.orm import validates
 from base import Base, IIQ_Datatype as IIQ
 import config
-import requests
 
 
 class Location(Base, IIQ):
@@ -45,62 +44,36 @@ class Location(Base, IIQ):
         'LocationType'
     ]
 
+    # Nested fields, as column -> JSON path
+    paths = {
+        'Street1': ('Address', 'Street1'),
+        'Street2': ('Address', 'Street2'),
+        'City': ('Address', 'City'),
+        'State': ('Address', 'State'),
+        'Zip': ('Address', 'Zip'),
+        'Country': ('Address', 'Country'),
+        'Latitude': ('Address', 'Latitude'),
+        'Longitude': ('Address', 'Longitude'),
+        'LocationType': ('LocationType', 'Name')
+    }
+
     @validates(*fields)
     def validate_inserts(self, key, value):
         return super().validate_inserts(key, value)
 
     def __init__(self, data):
-        # Call find_element on fields which are marked optional to be returned by the
-        # IncidentIQ API. This is especially important to note for nested fields, the
-        # parent of which can be optional even though when included there can
-        # be required fields
-        self.LocationId = data.LocationId
-        self.SiteId = data.SiteId
-        self.Name = IIQ.find_element(data, 'Name')
-        self.Abbreviation = IIQ.find_element(data, 'Abbreviation')
-        self.CreatedDate = data.CreatedDate
-        self.ModifiedDate = data.ModifiedDate
-        self.AddressId = data.AddressId
-        self.Street1 = IIQ.find_element(data, 'Address', 'Street1')
-        self.Street2 = IIQ.find_element(data, 'Address', 'Street2')
-        self.City = IIQ.find_element(data, 'Address', 'City')
-        self.State = IIQ.find_element(data, 'Address', 'State')
-        self.Zip = IIQ.find_element(data, 'Address', 'Zip')
-        self.Country = IIQ.find_element(data, 'Address', 'Country')
-        self.Latitude = IIQ.find_element(data, 'Address', 'Latitude')
-        self.Longitude = IIQ.find_element(data, 'Address', 'Longitude')
-        self.LocationTypeId = data.LocationTypeId
-        self.LocationType = IIQ.find_element(data, 'LocationType', 'Name')
+        # Extract fields from the raw data with the extractor compiled from
+        # fields and paths. Every lookup is safe, which is especially important
+        # to note for nested fields, the parent of which can be optional even
+        # though when included there can be required fields
+        self.set_fields(data)
 
     @staticmethod
-    def get_data_request(page_number):
-        url = "https://" + config.IIQ_INSTANCE + "/api/V1.0/locations?$p=" + str(
+    def page_request(page_number):
+        path = "/api/V1.0/locations?$p=" + str(
             page_number) + "&$s=" + str(config.PAGE_SIZE)
-
-        payload = {}
-        headers = {
-            'Connection': 'keep-alive',
-            'Client': 'WebBrowser',
-            'Accept': 'application/json, text/plain, */*',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/69.0.3497.100 Safari/537.36',
-            'Sec-Fetch-Site': 'same-origin',
-            'Sec-Fetch-Mode': 'cors',
-            'Sec-Fetch-Dest': 'empty',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Authorization': 'Bearer ' + config.IIQ_TOKEN
-        }
-
-        return requests.request("GET",
-                                url,
-                                headers=headers,
-                                data=payload,
-                                timeout=config.TIMEOUT)
-
-    @staticmethod
-    def get_num_pages():
-        return Location.get_data_request(0).json()['Paging']['PageCount']
+        return "GET", path, None
 
     @classmethod
-    def get_page(cls, page_number):
-        return super().get_page(page_number)
+    def get_page(cls, page_number, page=None):
+        return super().get_page(page_number, page)
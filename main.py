@@ -8,10 +8,13 @@ the IncidentIQ API. Inventory data recieved from the IncidentIQ
 API is inserted into the configured database via SqlAlchemy ORM mappings.    
 """
 
+import argparse
+import functools
+import os
 import time
-import concurrent.futures
 import pyodbc
-from base import Session, engine, Base, IIQ_Datatype
+from datetime import datetime
+from base import IIQ_Datatype, format_date
 from user import User
 from location import Location
 from asset import Asset
@@ -20,6 +23,20 @@ from room import Room
 from team import Team
 from custom_fields import UserCustomFields, AssetCustomFields, TicketCustomFields
 import config
+import bootstrap
+import writer
+import loaders
+import sync_state
+import staging
+import archive
+import schema
+import async_engine
+import pipeline
+import scheduler
+import retry
+import adaptive
+import metrics
+import profiling
 
 __author__ = "Alec Bailey"
 __license__ = "GPL-3.0"
@@ -28,74 +45,426 @@ __maintainer__ = "Alec Bailey"
 __email__ = "alecj.bailey@gmail.com"
 __status__ = "Development"
 
+# Tracks the latest ModifiedDate written for every type during this run
+watermarks = sync_state.WatermarkTracker()
+# Primary keys of every record written for every type during this run
+seen_keys = sync_state.SeenKeys()
+# Whether this run resumes an interrupted sync, whose last pages may have
+# been written without being checkpointed
+resuming = False
+
 
 # Dynamically create ORM mapped classes and tables from the existing
-# custom fields for individual types in IncidentIQ.
+# custom fields for individual types in IncidentIQ, loaded by bootstrap.run,
+# in the layout configured for the type
 def __generate_custom_fields_tables():
-    UserCustomFields.create_table(config.USERS_CF_TABLE_NAME, 'UserId')
-    AssetCustomFields.create_table(config.ASSETS_CF_TABLE_NAME, 'AssetId')
-    TicketCustomFields.create_table(config.TICKETS_CF_TABLE_NAME, 'TicketId')
+    layouts = config.CUSTOM_FIELD_LAYOUTS
+    UserCustomFields.create_table(config.USERS_CF_TABLE_NAME, 'UserId',
+                                  layouts.get('user', 'wide'))
+    AssetCustomFields.create_table(config.ASSETS_CF_TABLE_NAME, 'AssetId',
+                                   layouts.get('asset', 'wide'))
+    TicketCustomFields.create_table(config.TICKETS_CF_TABLE_NAME, 'TicketId',
+                                    layouts.get('ticket', 'wide'))
+
 
+# One unit of work, executed by a thread. Preforms a web request to the
+# IncidentIQ API. Inserts the returned elements into the appropriate database
+# table with the configured writer, and commits the changes. fetched is an
+# optional already decoded Page for index. When since is passed only records
+# modified since then are requested, and replace existing rows, as they do
+# when resuming. targets optionally redirects rows to shadow tables (See
+# staging.py). Records already written by another page of this run are
+# skipped. Returns True once the page is committed and checkpointed.
+def __sync_object(cls: IIQ_Datatype,
+                  index,
+                  fetched=None,
+                  since=None,
+                  targets=None):
+    keys = []
 
-# One unit of work, executed by a thread. Creates a session and preforms a web
-# request to the IncidentIQ API. Inserts the returned elements into the
-# appropriate database table, and commits the changes.
-def __sync_object(cls: IIQ_Datatype, index):
+    # Skip the records of every batch of the page already written, the
+    # watermark is only stored once every page of the type is committed
+    def claim(batch):
+        batch.items, claimed = seen_keys.claim(
+            cls.__name__,
+            loaders.primary_key(cls.__table__).name, batch.items)
+        keys.extend(claimed)
+        watermarks.observe(cls.__name__, batch.items)
+
+    page = fetched
     try:
-        session = Session()
-        # Retrieve an entire API Page worth of objects
-        page = cls.get_page(index)
-        # Add each object to the session and commit it
-        session.add_all(page)
-        session.commit()
-        session.close()
+        # Retrieve an entire API Page worth of items, reusing the
+        # already fetched page when one is passed in
+        if page is None:
+            page = cls.fetch_page(index, since)
+        writer.write_page(cls,
+                          page,
+                          replace=since is not None or resuming,
+                          targets=targets,
+                          prepare=claim)
+        if since is not None:
+            watermarks.observe_total(cls.__name__, page.paging)
+        sync_state.checkpoint(cls.__name__, index)
+        return True
 
     #TODO: kill parent on error
     except pyodbc.Error as e:
+        seen_keys.release(cls.__name__, keys)
         print("A pyodbc occured in a thread ", e)
+        return False
     except Exception as e:
+        seen_keys.release(cls.__name__, keys)
         print("A non pyodbc error occured - refer to documenation", e)
         raise e
+    finally:
+        # Release the connection of a streamed page, read or not
+        if page is not None:
+            page.close()
+
+
+# Preforms a web request for a page to the IncidentIQ API, returning the
+# decoded Page, or a StreamedPage decoded as it is written when Streaming is
+# set. Errors are reported before being raised.
+def __fetch_page(cls: IIQ_Datatype, index, since=None):
+    try:
+        if config.STREAMING:
+            return cls.stream_page(index, since)
+        return cls.fetch_page(index, since)
+    except Exception as e:
+        print("A request for page %d of %s failed" % (index, cls.__name__), e)
+        raise e
+
+
+# One fetch, executed by a fetcher thread. Waits for room in the budget of
+# pages in flight, fetches a page and hands it to the writers of pages,
+# waiting while too many fetched pages are already waiting to be written. The
+# page's share of the budget is released once it is written.
+def __fetch_object(cls: IIQ_Datatype,
+                   index,
+                   pages,
+                   budget,
+                   since=None,
+                   targets=None):
+    # A streamed page holds one batch of items at a time
+    reserved = budget.reserve(
+        cls,
+        config.STREAM_BATCH_SIZE if config.STREAMING else int(
+            config.PAGE_SIZE))
+    try:
+        page = __fetch_page(cls, index, since)
+    except Exception:
+        budget.release(reserved)
+        raise
+    try:
+        reserved = budget.observe(cls, reserved, page.memory,
+                                  page.items_held)
+        pages.put((cls, index),
+                  profiling.wrap(
+                      budget.releasing(
+                          reserved,
+                          functools.partial(__sync_object, cls, index, page,
+                                            since, targets))))
+    except BaseException:
+        # The page is dropped without being written
+        page.close()
+        budget.release(reserved)
+        raise
+
 
+# Sync all of the specified types into the database at once. syncs is a list
+# of (type, since, targets, skip) tuples. When since is passed only records of
+# the type modified since then are synced. Rows are written to the shadow
+# tables in targets when passed. Page numbers in skip, already committed by an
+# interrupted sync, are not synced again. first_pages holds page 0 of every
+# type, or the exception raised fetching it (See bootstrap.py). Returns the
+# set of types which synced every page.
+def __execute_syncs(syncs, first_pages):
+    # A replay reads pages from the archive on disk with the threads engine
+    if config.ENGINE == 'async' and not archive.replaying:
+        # Keep up to config.CONCURRENCY requests in flight on one thread,
+        # writing pages with config.WRITERS threads (See async_engine.py)
+        results = async_engine.sync([
+            (IIQ_Type, since,
+             profiling.wrap(
+                 functools.partial(__sync_object,
+                                   IIQ_Type,
+                                   since=since,
+                                   targets=targets)),
+             config.TYPE_CONCURRENCY.get(IIQ_Type.__name__.lower()), skip)
+            for IIQ_Type, since, targets, skip in syncs
+        ], first_pages)
+    else:
+        # config.WRITERS writer threads call __sync_object for every fetched
+        # page, writing it to the database. At most config.QUEUE_SIZE fetched
+        # pages wait for a writer (See pipeline.py)
+        pages = pipeline.Pipeline(config.WRITERS, config.QUEUE_SIZE)
+        # Fetchers wait while config.PAGES_IN_FLIGHT pages, or an estimated
+        # config.MEMORY_BUDGET MB of pages, are fetched but not yet written
+        budget = pipeline.Budget(config.PAGES_IN_FLIGHT or None,
+                                 int(config.MEMORY_BUDGET * 2**20) or None)
 
-# Sync all of a specified type into the database
-def __execute_sync(IIQ_Type: IIQ_Datatype):
-    # Retrieve the number of pages the passed type has in IncidentIQ
-    num_pages = IIQ_Type.get_num_pages()
+        # config.THREADS threads fetch the pages of every type, each thread
+        # requests exactly one page of the API response (by default 1000
+        # objects) at a time and hands it to the writers, waiting while the
+        # queue of pages is full. Threads take the next page of the type with
+        # the most pages left, capped per type (See scheduler.py)
+        fetchers = scheduler.Scheduler(int(config.THREADS))
+        failed_fetches = {}
+        for IIQ_Type, since, targets, skip in syncs:
+            # Page 0 holds the number of pages the type has in IncidentIQ,
+            # it is synced as is rather than requested a second time. Once
+            # queued only its write holds it, so it is freed once written
+            first_page = first_pages.pop(IIQ_Type)
+            if isinstance(first_page, Exception):
+                failed_fetches[(IIQ_Type, 0)] = first_page
+                continue
+            page_count = first_page.page_count
+            if 0 not in skip:
+                # Already fetched, it is counted in the budget without waiting
+                reserved = budget.observe(
+                    IIQ_Type,
+                    budget.reserve(IIQ_Type,
+                                   first_page.items_held,
+                                   wait=False), first_page.memory,
+                    first_page.items_held)
+                pages.put((IIQ_Type, 0),
+                          profiling.wrap(
+                              budget.releasing(
+                                  reserved,
+                                  functools.partial(__sync_object, IIQ_Type,
+                                                    0, first_page, since,
+                                                    targets))))
+            first_page = None
+            fetchers.add(
+                IIQ_Type, [
+                    index for index in range(1, page_count)
+                    if index not in skip
+                ],
+                profiling.wrap(
+                    functools.partial(__fetch_object,
+                                      IIQ_Type,
+                                      pages=pages,
+                                      budget=budget,
+                                      since=since,
+                                      targets=targets)),
+                config.TYPE_CONCURRENCY.get(IIQ_Type.__name__.lower()))
+        for key, result in fetchers.run().items():
+            if isinstance(result, Exception):
+                failed_fetches[key] = result
+        results = pages.close()
+        results.update(failed_fetches)
 
-    # Create a thread pool with config.THREADS number of threads. This calls __sync_object
-    # for each page of the API we wish to request, from page 0 to num_pages. Each thread
-    # is responsible for adding exactly one page of the API response (by default 1000 objects)
-    # to it's session and commiting the data to the database. Threads then exit, making room
-    # for another thread to fetch and operate on the next page for as many pages as are present
-    with concurrent.futures.ThreadPoolExecutor(
-            max_workers=int(config.THREADS)) as executor:
-        thread = {
-            executor.submit(__sync_object, IIQ_Type, index): index
-            for index in range(0, num_pages)
-        }
+    succeeded = set()
+    for IIQ_Type, since, targets, skip in syncs:
+        failed = [
+            index for (cls, index), result in results.items()
+            if cls is IIQ_Type and result is not True
+        ]
+        if failed:
+            print("%d pages of %s failed to sync" %
+                  (len(failed), IIQ_Type.__name__))
+        else:
+            succeeded.add(IIQ_Type)
+    return succeeded
+
+
+# Store the latest ModifiedDate synced for a type as its watermark. Must only
+# be called once a type synced without errors, otherwise the records of a
+# failed page would never be requested again. The watermark of changes since
+# since is kept when the changes shifted while paged, so the next sync
+# requests them again rather than skip any shifted past a page
+def __record_watermark(IIQ_Type: IIQ_Datatype, since=None):
+    if since is not None and watermarks.shifted(IIQ_Type.__name__):
+        print("The changes to %s shifted while syncing, they are requested "
+              "again by the next sync" % IIQ_Type.__name__)
+        return
+    watermark = watermarks.watermark(IIQ_Type.__name__,
+                                     IIQ_Datatype.snapshot)
+    if IIQ_Type.incremental and watermark is not None:
+        sync_state.set_watermark(IIQ_Type.__name__, watermark)
+
+
+# Write the JSON report and the Prometheus textfile of this run, when Report
+# or Metrics are set (See metrics.py)
+def __write_report(syncs, succeeded, start_time, stop_time):
+    synced = {
+        IIQ_Type.__name__: IIQ_Type in succeeded
+        for IIQ_Type, _, _, _ in syncs
+    }
+    if config.REPORT:
+        metrics.write_json(
+            config.REPORT, {
+                'Started': format_date(datetime.utcfromtimestamp(start_time)),
+                'Seconds': stop_time - start_time,
+                'Succeeded': synced,
+                'Types': metrics.stats.summary(),
+                'Tables': {
+                    table_name: {
+                        'Rows': rows,
+                        'Seconds': seconds
+                    } for table_name, (rows,
+                                       seconds) in writer.stats.tables.items()
+                },
+                'Endpoints': {
+                    endpoint: {
+                        'Requests': requests,
+                        'Retries': retries
+                    } for endpoint, (requests,
+                                     retries) in retry.stats.endpoints.items()
+                }
+            })
+    if config.METRICS:
+        metrics.write_prometheus(config.METRICS, metrics.stats,
+                                 stop_time - start_time, synced)
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Sync IncidentIQ data into the configured database")
+    parser.add_argument(
+        '--incremental',
+        action='store_true',
+        help="keep existing data and only sync records modified since the "
+        "last successful sync, types which cannot be synced incrementally "
+        "are reloaded in full")
+    parser.add_argument(
+        '--staging',
+        action='store_true',
+        help="load types which are reloaded in full into shadow tables, "
+        "swapping them in once every page succeeded so existing tables are "
+        "never seen empty")
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help="resume an interrupted sync, run with the same options, types "
+        "and pages the interrupted sync committed are not synced again")
+    parser.add_argument(
+        '--refresh-custom-fields',
+        action='store_true',
+        help="request custom field definitions from IncidentIQ rather than "
+        "reading them from the cache")
+    parser.add_argument(
+        '--replay',
+        nargs='?',
+        const='',
+        metavar='ARCHIVE',
+        help="sync from the pages archived in ARCHIVE, or the configured "
+        "Archive, rather than requesting them from IncidentIQ")
+    parser.add_argument(
+        '--profile',
+        nargs='?',
+        const='',
+        metavar='DIRECTORY',
+        help="profile the CPU and memory of every thread, writing the "
+        "profiles to DIRECTORY, or next to the configured Report (slower)")
+    args = parser.parse_args()
+
     start_time = time.time()
-    __generate_custom_fields_tables()
-    # Drop all tables to pull fresh data
-    Base.metadata.drop_all(bind=engine)
-    # Generate database schema from SqlAlchemy
-    Base.metadata.create_all(engine)
-
-    # Execute the sync for all types
-    __execute_sync(Team)
-    __execute_sync(Ticket)
-    __execute_sync(User)
-    __execute_sync(Location)
-    __execute_sync(Asset)
-    __execute_sync(Room)
-
-    # Useful for testing without threading issues
-    #num_pages = Asset.get_num_pages()
-    #for i in range(0, 1):
-    #    __sync_object(Asset, i)
-
-    stop_time = time.time()
-    print("Execution took --- %s seconds ---" % (stop_time - start_time))
+    if args.profile is not None:
+        profiling.start(args.profile or os.path.dirname(config.REPORT))
+    # Profiles are written however the sync ends, the syncs which raise or
+    # are interrupted being the ones most worth profiling
+    try:
+        if args.replay is not None:
+            archive.start_replay(args.replay)
+        sync_state.create_tables()
+        runs = sync_state.get_runs() if args.resume else {}
+        # Only a sync which left some type unfinished is resumed, the runs of a
+        # completed sync are kept until the next one starts
+        resuming = any(not finished for _, _, finished in runs.values())
+        if args.resume and not resuming:
+            print("There is no interrupted sync to resume, syncing in full")
+        if not resuming:
+            runs = {}
+            sync_state.start_run()
+        # Records created after the snapshot are left out of this run, so new
+        # records cannot shift others across pages. A resumed run keeps the
+        # snapshot of the interrupted run so its pages line up
+        if resuming:
+            IIQ_Datatype.snapshot = next(iter(runs.values()))[1]
+        else:
+            IIQ_Datatype.snapshot = format_date(datetime.utcnow())
+
+        # Decide what to sync of every type
+        plans = []
+        for IIQ_Type in (Team, Ticket, User, Location, Asset, Room):
+            since = None
+            skip = set()
+            run = runs.get(IIQ_Type.__name__)
+            if run is not None:
+                since, _, finished = run
+                if finished:
+                    continue
+                # Pick up where the interrupted sync of the type left off, with
+                # the since it was started with so pages line up
+                skip = sync_state.get_checkpoints(IIQ_Type.__name__)
+                print("Resuming %s, %d pages already synced" %
+                      (IIQ_Type.__name__, len(skip)))
+            else:
+                if args.incremental and IIQ_Type.incremental:
+                    since = sync_state.get_watermark(IIQ_Type.__name__)
+                sync_state.start_type(IIQ_Type.__name__, since,
+                                      IIQ_Datatype.snapshot)
+                if archive.archiving():
+                    # The archive holds the pages of the last sync of a type
+                    archive.clear(IIQ_Type.__name__)
+            plans.append((IIQ_Type, since, skip, run))
+
+        # Load every custom field and the first page of every type at once
+        first_pages = bootstrap.run([(IIQ_Type, since)
+                                     for IIQ_Type, since, _, _ in plans],
+                                    args.refresh_custom_fields)
+        __generate_custom_fields_tables()
+        # Create or alter the tables whose definition changed, keeping their
+        # data (See schema.py)
+        schema.reconcile()
+
+        # Prepare the sync of every type
+        syncs = []
+        for IIQ_Type, since, skip, run in plans:
+            targets = None
+            if since is None and args.staging:
+                # Reload in full into shadow tables, the live tables keep their
+                # data until every page succeeded
+                targets = staging.stage(IIQ_Type, keep=run is not None)
+            elif since is None and run is None:
+                # Reload in full, emptying the tables to pull fresh data
+                writer.clear(IIQ_Type)
+            syncs.append((IIQ_Type, since, targets, skip))
+
+        # Execute the sync for all types at once
+        succeeded = __execute_syncs(syncs, first_pages)
+        for IIQ_Type, since, targets, skip in syncs:
+            if targets is not None:
+                if IIQ_Type in succeeded:
+                    staging.swap(targets)
+                    # The swapped in tables were created from the models, any
+                    # deprecated column was dropped with the previous tables
+                    for table in targets:
+                        sync_state.set_schema(table.name,
+                                              schema.fingerprint(table))
+                else:
+                    # The pages written to the discarded tables must be synced
+                    # again by a resumed sync
+                    staging.discard(targets)
+                    sync_state.clear_checkpoints(IIQ_Type.__name__)
+                    print("Kept the previous %s data" % IIQ_Type.__name__)
+            if IIQ_Type in succeeded:
+                __record_watermark(IIQ_Type, since)
+                sync_state.finish_type(IIQ_Type.__name__)
+
+        # Useful for testing without threading issues
+        #num_pages = Asset.get_num_pages()
+        #for i in range(0, 1):
+        #    __sync_object(Asset, i)
+
+        stop_time = time.time()
+        print(writer.stats.report())
+        print(retry.stats.report())
+        if adaptive.controller is not None:
+            print(adaptive.controller.report())
+        print(metrics.stats.report())
+        print("Execution took --- %s seconds ---" % (stop_time - start_time))
+    finally:
+        profiling.stop()
+    __write_report(syncs, succeeded, start_time, stop_time)
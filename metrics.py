@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""metrics.py: Per stage timings of every page synced, and the run report
+
+Every page synced passes through the same stages: waiting on the HTTP
+request to IncidentIQ (retries included), decoding the JSON response,
+building mapped objects or plain rows from its items, flushing them to
+the database and committing. The seconds every page spent in every
+stage, and the bytes received for it, are recorded per type, so a slow
+sync can be pinned on IncidentIQ's latency or on the database.
+
+At the end of a sync the distribution of every stage of every type
+(pages, total, p50, p95 and max seconds) is printed, and optionally
+written as a JSON report (Report in config.ini) and as a Prometheus
+textfile (Metrics in config.ini) for node_exporter's textfile collector.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Stages of a page in the order they happen, Eg. 'http' is the time spent
+# waiting on IncidentIQ. Replayed pages spend reading the archive in decode
+STAGES = ('http', 'decode', 'build', 'flush', 'commit')
+# Quantiles reported for every stage
+QUANTILES = (0.5, 0.95)
+# Prefix of every Prometheus metric
+PROMETHEUS_PREFIX = 'iiq_sync'
+
+
+# The q-quantile of samples, sorted ascending, by nearest rank
+def quantile(samples, q):
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, max(0, round(q * len(samples)) - 1))]
+
+
+class StageStats:
+    """StageStats keeps the seconds every page spent in every stage, and
+    the bytes received for every page, per type. Safe to record into from
+    any number of threads at once.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}    # Type name -> {stage: [seconds of every page]}
+        self.bytes = {}    # Type name -> bytes received
+
+    def record(self, type_name, stage, seconds):
+        with self.lock:
+            self.samples.setdefault(type_name, {}).setdefault(stage,
+                                                              []).append(seconds)
+
+    def record_bytes(self, type_name, count):
+        with self.lock:
+            self.bytes[type_name] = self.bytes.get(type_name, 0) + count
+
+    # Time the body of a with statement as a stage of a page of a type
+    # Eg. with metrics.stats.time('Asset', 'decode'): data = response.json()
+    @contextmanager
+    def time(self, type_name, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(type_name, stage, time.perf_counter() - start)
+
+    # Returns the distribution of every stage of every type, Eg.
+    # {'Asset': {'Bytes': 1048576, 'Stages': {'http': {'Pages': 20,
+    # 'Seconds': 6.1, 'P50': 0.3, 'P95': 0.5, 'Max': 0.6}, ...}}}
+    def summary(self):
+        with self.lock:
+            samples = {
+                type_name: {
+                    stage: sorted(seconds)
+                    for stage, seconds in stages.items()
+                } for type_name, stages in self.samples.items()
+            }
+            received = dict(self.bytes)
+        summary = {}
+        for type_name in sorted(set(samples) | set(received)):
+            stages = samples.get(type_name, {})
+            summary[type_name] = {
+                'Bytes': received.get(type_name, 0),
+                'Stages': {
+                    stage: {
+                        'Pages': len(seconds),
+                        'Seconds': sum(seconds),
+                        'P50': quantile(seconds, 0.5),
+                        'P95': quantile(seconds, 0.95),
+                        'Max': seconds[-1]
+                    } for stage, seconds in sorted(
+                        stages.items(),
+                        key=lambda entry: STAGES.index(entry[0])
+                        if entry[0] in STAGES else len(STAGES))
+                }
+            }
+        return summary
+
+    # Returns one line per type and stage, Eg.
+    # 'Asset http: 20 pages, 6.10 s (p50 0.300 s, p95 0.500 s, max 0.600 s)'
+    def report(self):
+        lines = []
+        for type_name, summary in self.summary().items():
+            for stage, timing in summary['Stages'].items():
+                lines.append(
+                    "%s %s: %d pages, %.2f s (p50 %.3f s, p95 %.3f s, "
+                    "max %.3f s)" %
+                    (type_name, stage, timing['Pages'], timing['Seconds'],
+                     timing['P50'], timing['P95'], timing['Max']))
+            if summary['Bytes']:
+                lines.append("%s received: %d bytes" %
+                             (type_name, summary['Bytes']))
+        return "\n".join(lines)
+
+
+# Write text to path atomically through a temporary file, so a collector
+# never reads a half written report
+def write_file(path, text):
+    temporary = path + '.tmp'
+    with open(temporary, 'w', encoding='utf-8') as report_file:
+        report_file.write(text)
+    os.replace(temporary, path)
+
+
+# Write report, a dict holding the summary of a run (See main.py), as JSON
+def write_json(path, report):
+    write_file(path, json.dumps(report, indent=2) + "\n")
+
+
+# Returns the summary of stats, the seconds a run took and the types which
+# synced every page in the Prometheus text exposition format
+def prometheus(stats, seconds, succeeded):
+    stage_metric = PROMETHEUS_PREFIX + '_stage_seconds'
+    lines = [
+        "# HELP %s Seconds a page spent in a stage of a sync" % stage_metric,
+        "# TYPE %s summary" % stage_metric
+    ]
+    maxima = []
+    received = []
+    for type_name, summary in stats.summary().items():
+        for stage, timing in summary['Stages'].items():
+            labels = 'type="%s",stage="%s"' % (type_name, stage)
+            for q in QUANTILES:
+                lines.append('%s{%s,quantile="%g"} %.6f' %
+                             (stage_metric, labels, q,
+                              timing['P%d' % round(q * 100)]))
+            lines.append("%s_sum{%s} %.6f" %
+                         (stage_metric, labels, timing['Seconds']))
+            lines.append("%s_count{%s} %d" %
+                         (stage_metric, labels, timing['Pages']))
+            maxima.append("%s_max_seconds{%s} %.6f" %
+                          (PROMETHEUS_PREFIX + '_stage', labels,
+                           timing['Max']))
+        received.append('%s_received_bytes{type="%s"} %d' %
+                        (PROMETHEUS_PREFIX, type_name, summary['Bytes']))
+
+    lines += [
+        "# HELP %s_stage_max_seconds Longest a page spent in a stage of a "
+        "sync" % PROMETHEUS_PREFIX,
+        "# TYPE %s_stage_max_seconds gauge" % PROMETHEUS_PREFIX
+    ] + maxima
+    lines += [
+        "# HELP %s_received_bytes Bytes received from IncidentIQ by a sync" %
+        PROMETHEUS_PREFIX,
+        "# TYPE %s_received_bytes gauge" % PROMETHEUS_PREFIX
+    ] + received
+    lines += [
+        "# HELP %s_succeeded Whether every page of a type synced" %
+        PROMETHEUS_PREFIX,
+        "# TYPE %s_succeeded gauge" % PROMETHEUS_PREFIX
+    ] + [
+        '%s_succeeded{type="%s"} %d' %
+        (PROMETHEUS_PREFIX, type_name, int(synced))
+        for type_name, synced in sorted(succeeded.items())
+    ]
+    lines += [
+        "# HELP %s_duration_seconds Seconds the last sync took" %
+        PROMETHEUS_PREFIX,
+        "# TYPE %s_duration_seconds gauge" % PROMETHEUS_PREFIX,
+        "%s_duration_seconds %.3f" % (PROMETHEUS_PREFIX, seconds),
+        "# HELP %s_last_run_timestamp_seconds When the last sync finished" %
+        PROMETHEUS_PREFIX,
+        "# TYPE %s_last_run_timestamp_seconds gauge" % PROMETHEUS_PREFIX,
+        "%s_last_run_timestamp_seconds %.3f" % (PROMETHEUS_PREFIX, time.time())
+    ]
+    return "\n".join(lines) + "\n"
+
+
+# Write the Prometheus textfile of a run, See prometheus
+def write_prometheus(path, stats, seconds, succeeded):
+    write_file(path, prometheus(stats, seconds, succeeded))
+
+
+# Timings of every page synced in this process
+stats = StageStats()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""pipeline.py: Decouples fetching pages from writing them
+
+A Pipeline runs a fixed number of writer threads draining a bounded
+queue of fetched pages into the database. Any number of fetcher threads
+put pages into the queue as they arrive from the API. Once the queue is
+full, fetchers block until a writer takes a page, so the pages held in
+memory stay bounded however many fetchers there are, and the database
+only ever sees as many connections as there are writers.
+
+A Budget further bounds the pages in flight, fetched or being fetched
+but not yet written, to a window of pages and to an estimated size in
+memory, so a large sync fits the memory of a small machine however many
+fetchers there are. Fetchers wait for room in the budget before
+fetching, and a page's share is released as soon as it is written.
+"""
+
+import queue
+import threading
+
+# Estimated bytes in memory of an item of a key no page was measured of yet,
+# several times the largest IncidentIQ item, so the first pages of a type
+# cannot overrun the budget before their size is known
+DEFAULT_ITEM_SIZE = 65536
+
+
+class Pipeline:
+    """Pipeline hands writes put by fetcher threads to writers threads,
+    which call them in turn. At most capacity writes wait in the queue.
+    The result of every write, or the exception it raised, is kept by the
+    key it was put with and returned by close.
+    """
+
+    def __init__(self, writers=4, capacity=8):
+        self.queue = queue.Queue(maxsize=capacity)
+        self.lock = threading.Lock()
+        self.results = {}    # Key -> result of write or exception
+        self.threads = [
+            threading.Thread(target=self.__write, daemon=True)
+            for _ in range(writers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    # Queue write, a callable writing a fetched page (Eg. a functools.partial
+    # holding the page), blocking while the queue is full
+    def put(self, key, write):
+        self.queue.put((key, write))
+
+    # Executed by every writer thread until close queues a None per writer
+    def __write(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            key, write = job
+            try:
+                result = write()
+            except Exception as e:
+                result = e
+            # Drop the written page now rather than once the next arrives
+            del job, write
+            with self.lock:
+                self.results[key] = result
+
+    # Wait for every queued write to complete and stop the writers. Returns
+    # the dict of key -> result of write or exception raised.
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        return self.results
+
+
+class Budget:
+    """Budget bounds the pages in flight to at most pages at once and, when
+    size is set, their estimated bytes in memory to size. A page reserves
+    the estimated bytes of the items it is expected to hold before it is
+    fetched, learned from the pages of its key (Eg. type) fetched so far or
+    item_size bytes an item until one was, corrects its reservation once
+    fetched and releases it once written. A page whose size is unknown
+    keeps its reservation. A page is always let through when no other is
+    in flight, however large.
+    """
+
+    def __init__(self, pages=None, size=None, item_size=DEFAULT_ITEM_SIZE):
+        self.condition = threading.Condition()
+        self.max_pages = pages
+        self.max_size = size
+        self.item_size = item_size
+        self.pages = 0    # Pages in flight
+        self.size = 0    # Estimated bytes of the pages in flight
+        self.item_sizes = {}    # Key -> estimated bytes of an item
+
+    # Whether a page of size bytes fits in the budget, the lock of condition
+    # must be held
+    def __fits(self, size):
+        return ((self.max_pages is None or self.pages < self.max_pages) and
+                (self.max_size is None or self.size + size <= self.max_size))
+
+    # Reserve room for a page of key expected to hold items items, waiting
+    # (when wait is set) until it fits. Returns the bytes reserved
+    def reserve(self, key, items, wait=True):
+        with self.condition:
+            size = int(self.item_sizes.get(key, self.item_size) * items)
+            while wait and self.pages and not self.__fits(size):
+                self.condition.wait()
+            self.pages += 1
+            self.size += size
+            return size
+
+    # Correct the reservation of a fetched page of key holding items items to
+    # its estimated size, None when unknown. Returns the bytes now reserved
+    def observe(self, key, reserved, size, items):
+        if size is None:
+            return reserved
+        with self.condition:
+            if items:
+                self.item_sizes[key] = size / items
+            self.size += size - reserved
+            if size < reserved:
+                self.condition.notify_all()
+        return size
+
+    # Release the reservation of a page which was written or failed
+    def release(self, reserved):
+        with self.condition:
+            self.pages -= 1
+            self.size -= reserved
+            self.condition.notify_all()
+
+    # Returns write, releasing reserved once it has run
+    def releasing(self, reserved, write):
+
+        def release_after():
+            try:
+                return write()
+            finally:
+                self.release(reserved)
+
+        return release_after
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+"""profiling.py: Where the CPU and memory of a sync go, with --profile
+
+A sync run with --profile is profiled three ways at once, across every
+fetcher, writer and event loop thread:
+
+Every page fetched or written runs under a cProfile profiler of the
+thread running it, and the profiles of every thread are merged into
+profile.pstats once the sync is done (Eg. python -m pstats
+profile.pstats, or snakeviz). The functions which took the most time are
+printed.
+
+The stacks of every thread are sampled every SAMPLE_INTERVAL seconds and
+written as collapsed stacks to profile.collapsed, one line per stack
+with the number of times it was seen, as flamegraph.pl and speedscope
+read them. Sampling also sees the event loop of the async engine, and
+keeps working where cProfile cannot profile several threads at once
+(Python 3.12 and later, where such pages run without cProfile).
+
+The peak memory traced with tracemalloc while a page is built into
+mapped objects or rows (See writer.py) is recorded per type, written to
+profile_memory.json and printed, with the peak of the whole sync. A
+streamed page is built one batch at a time, its peak is that of its
+largest batch. Pages are built one at a time while profiling so every
+peak is their own, although memory allocated meanwhile by fetcher
+threads is counted too.
+
+Profiling slows the sync down, tracemalloc considerably, the timings it
+reports are relative to each other rather than to an unprofiled sync.
+"""
+
+import cProfile
+import functools
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# Seconds between two samples of the stacks of every thread
+SAMPLE_INTERVAL = 0.005
+# Functions printed at the end of a profiled sync
+TOP_FUNCTIONS = 15
+
+# Whether this sync is profiled, set by start
+active = False
+# Directory profiles are written to
+directory = None
+
+_local = threading.local()
+_lock = threading.Lock()
+_profilers = []    # cProfile profiler of every thread
+_unprofiled = 0    # Jobs run without cProfile, as another profiler was active
+_memory_lock = threading.Lock()
+_memory = {}    # Type name -> {page number: peak bytes of building it}
+_peak = 0    # Peak bytes traced before the last page was built
+_sampler = None
+
+
+class Sampler(threading.Thread):
+    """Sampler samples the stack of every other thread every interval
+    seconds until stopped, counting every stack seen. Stacks are keyed
+    by the name of their thread with any number removed (Eg. every
+    writer thread is 'Thread- (__write)'), so threads doing the same work
+    are merged.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        super().__init__(name='ProfileSampler', daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.stacks = {}    # Collapsed stack -> samples
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            names = {
+                thread.ident: re.sub(r'\d+', '', thread.name)
+                for thread in threading.enumerate()
+            }
+            for ident, frame in sys._current_frames().items():
+                if ident == self.ident:
+                    continue
+                functions = []
+                while frame is not None:
+                    code = frame.f_code
+                    functions.append(
+                        "%s (%s:%d)" % (code.co_name,
+                                        os.path.basename(code.co_filename),
+                                        code.co_firstlineno))
+                    frame = frame.f_back
+                functions.append(names.get(ident, 'thread'))
+                stack = ";".join(reversed(functions))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    # The samples as collapsed stacks, Eg.
+    # 'Thread- (__write);__write (pipeline.py:37);... 42'
+    def collapsed(self):
+        return "".join("%s %d\n" % (stack, count)
+                       for stack, count in sorted(self.stacks.items()))
+
+
+# Start profiling this sync, writing profiles to path (the current
+# directory when blank) once stopped
+def start(path=None):
+    global active, directory, _sampler
+    directory = path or '.'
+    os.makedirs(directory, exist_ok=True)
+    tracemalloc.start()
+    _sampler = Sampler()
+    _sampler.start()
+    active = True
+
+
+# Returns function, calling it under the cProfile profiler of the calling
+# thread while profiling (Eg. the jobs of fetcher and writer threads)
+def wrap(function):
+
+    @functools.wraps(function)
+    def profiled(*args, **kwargs):
+        global _unprofiled
+        # Calls nested in a profiled call are profiled by it already
+        if not active or getattr(_local, 'depth', 0):
+            return function(*args, **kwargs)
+        profiler = getattr(_local, 'profiler', None)
+        if profiler is None:
+            profiler = _local.profiler = cProfile.Profile()
+            with _lock:
+                _profilers.append(profiler)
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another thread's profiler is active (Python 3.12 and later)
+            with _lock:
+                _unprofiled += 1
+            return function(*args, **kwargs)
+        _local.depth = 1
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _local.depth = 0
+            profiler.disable()
+
+    return profiled
+
+
+# Record the peak memory traced while the body of a with statement builds
+# page number of a type, or a batch of it, while profiling
+@contextmanager
+def page_memory(type_name, number):
+    if not active:
+        yield
+        return
+    global _peak
+    with _memory_lock:
+        # The peak of the sync so far is lost once reset for this page
+        _peak = max(_peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        start_bytes = tracemalloc.get_traced_memory()[0]
+        try:
+            yield
+        finally:
+            peak = tracemalloc.get_traced_memory()[1] - start_bytes
+            peaks = _memory.setdefault(type_name, {})
+            peaks[number] = max(peaks.get(number, 0), peak)
+
+
+# Returns the distribution of the peak memory of the pages of every type,
+# Eg. {'Asset': {'Pages': 20, 'P50': 1048576, 'Max': 2097152}}
+def memory_summary():
+    summary = {}
+    with _memory_lock:
+        for type_name, peaks in sorted(_memory.items()):
+            peaks = sorted(peaks.values())
+            summary[type_name] = {
+                'Pages': len(peaks),
+                'P50': peaks[(len(peaks) - 1) // 2],
+                'Max': peaks[-1]
+            }
+    return summary
+
+
+# Stop profiling, write every profile to the directory and print a summary
+def stop():
+    global active
+    if not active:
+        return
+    active = False
+    _sampler.stop()
+    traced_peak = max(_peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    with open(os.path.join(directory, 'profile.collapsed'), 'w') as stacks:
+        stacks.write(_sampler.collapsed())
+    memory = memory_summary()
+    with open(os.path.join(directory, 'profile_memory.json'),
+              'w') as memory_file:
+        json.dump({'Peak': traced_peak, 'Pages': memory}, memory_file,
+                  indent=2)
+
+    with _lock:
+        profilers = list(_profilers)
+    profiles = [
+        pstats.Stats(profiler) for profiler in profilers
+        if profiler.getstats()
+    ]
+    if profiles:
+        merged = profiles[0]
+        for profile in profiles[1:]:
+            merged.add(profile)
+        merged.dump_stats(os.path.join(directory, 'profile.pstats'))
+        print("Profiled %d threads, most time spent in:" % len(profiles))
+        merged.sort_stats('tottime').print_stats(TOP_FUNCTIONS)
+    if _unprofiled:
+        print("%d pages ran without cProfile, as only one thread can be "
+              "profiled at once, see profile.collapsed" % _unprofiled)
+    for type_name, peaks in memory.items():
+        print("%s: %d pages built, peak memory p50 %.1f MB, max %.1f MB" %
+              (type_name, peaks['Pages'], peaks['P50'] / 2**20,
+               peaks['Max'] / 2**20))
+    print("Peak memory traced: %.1f MB, profiles written to %s" %
+          (traced_peak / 2**20, os.path.abspath(directory)))
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""retry.py: Retry policy for requests to the IncidentIQ API
+
+Every request to the IncidentIQ API, from either fetch engine, is retried
+on transient failures: rate limiting (429), server errors (5xx) and
+timeouts or dropped connections. Retries wait with exponential backoff
+and full jitter, or for as long as the API asks with a Retry-After
+header. Any other status is fatal and raised at once. The requests made
+and retries taken are counted per endpoint, so a sync reports how close
+to the rate limit it ran.
+"""
+
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import config
+
+# Statuses worth retrying, anything else but success is fatal
+RETRYABLE_STATUSES = (408, 425, 429, 500, 502, 503, 504)
+
+
+# The endpoint of a request path, the path without its query string
+# Eg. '/api/v1.0/assets/?$p=3&$s=1000' -> '/api/v1.0/assets/'
+def endpoint(path):
+    return path.split('?', 1)[0]
+
+
+# Parse a Retry-After header, either a number of seconds or an HTTP date,
+# into seconds to wait. Returns None for a missing or unparseable header.
+def parse_retry_after(value):
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+class RetryPolicy:
+    """RetryPolicy decides whether a failed request is retried and how long
+    to wait first. A request is attempted at most retries + 1 times. The
+    n-th retry waits a random time up to backoff * 2^n seconds, capped at
+    max_backoff, unless the API asked for a longer wait with Retry-After.
+    """
+
+    def __init__(self, retries=5, backoff=1.0, max_backoff=60.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    # Whether a request failing with status (None for a timeout or dropped
+    # connection) after attempt retries should be retried
+    def should_retry(self, attempt, status=None):
+        if attempt >= self.retries:
+            return False
+        return status is None or status in RETRYABLE_STATUSES
+
+    # Seconds to wait before retry number attempt + 1
+    def delay(self, attempt, retry_after=None):
+        delay = random.uniform(
+            0, min(self.max_backoff, self.backoff * 2**attempt))
+        wait = parse_retry_after(retry_after)
+        if wait is not None:
+            delay = max(delay, wait)
+        return delay
+
+
+class RetryStats:
+    """RetryStats counts the requests made and the retries taken, by reason
+    (status code or 'timeout'), for every endpoint. Safe to record into from
+    any number of threads at once.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}    # Endpoint -> [requests, {reason: retries}]
+
+    def record_request(self, endpoint):
+        with self.lock:
+            self.endpoints.setdefault(endpoint, [0, {}])[0] += 1
+
+    def record_retry(self, endpoint, reason):
+        with self.lock:
+            retries = self.endpoints.setdefault(endpoint, [0, {}])[1]
+            retries[reason] = retries.get(reason, 0) + 1
+
+    # Returns one line per endpoint, Eg.
+    # '/api/v1.0/assets/: 120 requests, 4 retries (429: 3, timeout: 1)'
+    def report(self):
+        lines = []
+        with self.lock:
+            for endpoint, (requests, retries) in self.endpoints.items():
+                line = "%s: %d requests, %d retries" % (
+                    endpoint, requests, sum(retries.values()))
+                if retries:
+                    line += " (%s)" % ", ".join(
+                        "%s: %d" % (reason, count)
+                        for reason, count in sorted(retries.items()))
+                lines.append(line)
+        return "\n".join(lines)
+
+
+# The retry policy of every request made in this process
+policy = RetryPolicy(config.RETRIES, config.RETRY_BACKOFF,
+                     config.RETRY_MAX_BACKOFF)
+# Statistics for every request made in this process
+stats = RetryStats()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""scheduler.py: Runs the pages of every type on one pool of threads
+
+Rather than syncing one type after another, every page of every type is
+added to a single Scheduler and run on one pool of worker threads, so
+the slow last pages of one type overlap the pages of the others instead
+of leaving most threads idle. Whenever a thread is free it takes the
+next page of the type with the most pages left to run (largest first),
+which keeps the run close to the time of its largest type. A type can
+be capped to a maximum number of pages running at once, its other pages
+wait while the threads run pages of other types.
+"""
+
+import threading
+
+
+class Scheduler:
+    """Scheduler runs run(index) for every index added for a key on at most
+    workers threads at a time, largest key first. The result of every run,
+    or the exception it raised, is returned by run keyed by (key, index).
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.condition = threading.Condition()
+        self.pending = {}    # Key -> list of indexes left to run
+        self.running = {}    # Key -> number of indexes running
+        self.caps = {}    # Key -> max indexes running at once, or None
+        self.jobs = {}    # Key -> run
+        self.results = {}    # (key, index) -> result of run or exception
+
+    # Add every index of indexes to be run with run(index). At most cap of
+    # them are run at the same time when cap is passed.
+    def add(self, key, indexes, run, cap=None):
+        with self.condition:
+            self.pending.setdefault(key, []).extend(reversed(indexes))
+            self.running.setdefault(key, 0)
+            self.caps[key] = cap
+            self.jobs[key] = run
+
+    # Returns the key to run next, the key with the most indexes left to run
+    # which is under its cap, or None if no key can run now. The lock of
+    # condition must be held.
+    def __next_key(self):
+        ready = [
+            key for key, indexes in self.pending.items()
+            if indexes and (self.caps[key] is None or
+                            self.running[key] < self.caps[key])
+        ]
+        if not ready:
+            return None
+        return max(ready, key=lambda key: len(self.pending[key]))
+
+    # Executed by every worker thread until no index is left to run
+    def __work(self):
+        while True:
+            with self.condition:
+                key = self.__next_key()
+                while key is None:
+                    if not any(self.pending.values()):
+                        return
+                    self.condition.wait()
+                    key = self.__next_key()
+                index = self.pending[key].pop()
+                self.running[key] += 1
+                run = self.jobs[key]
+
+            try:
+                result = run(index)
+            except Exception as e:
+                result = e
+
+            with self.condition:
+                self.results[(key, index)] = result
+                self.running[key] -= 1
+                self.condition.notify_all()
+
+    # Run every added index, returning once all have run. Returns the dict of
+    # (key, index) -> result of run or exception raised.
+    def run(self):
+        threads = [
+            threading.Thread(target=self.__work, daemon=True)
+            for _ in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return self.results
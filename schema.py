@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+"""schema.py: Reconciles the tables in the database with the models
+
+Rather than dropping and recreating every table each sync, the tables of
+Base.metadata are reconciled with the database in place, so their data
+is kept between syncs. The custom fields tables are defined from the
+custom fields existing in IncidentIQ today (See custom_fields.py), so
+their definition changes whenever a custom field is added or removed.
+
+The fingerprint of every table's definition is stored in SyncSchema once
+reconciled (See sync_state.py). A table whose fingerprint matches is left
+alone without issuing any DDL. Otherwise a missing table is created, and
+the columns missing from an existing table are added with ALTER TABLE
+ADD. Columns no longer defined (Eg. of a removed custom field) are kept
+and recorded as deprecated, kept as is or dropped depending on
+RemovedColumns. Changes to the type of an existing column are not
+migrated, nor are changes of primary key (Eg. a custom fields table
+switched to the long layout), such a table must be dropped first. A
+table altered outside of a sync is reconciled again once its row of
+SyncSchema is deleted.
+"""
+
+import hashlib
+from sqlalchemy import inspect, text
+from base import engine, Base
+import config
+import sync_state
+
+
+# Returns the fingerprint of the definition of table in the dialect of the
+# engine, the name, type, nullability and key of every column
+def fingerprint(table):
+    definition = "\n".join(
+        "%s %s %s %s" %
+        (column.name, column.type.compile(dialect=engine.dialect),
+         column.nullable, column.primary_key) for column in table.columns)
+    return hashlib.sha256(definition.encode()).hexdigest()
+
+
+# Reconcile every table of metadata with the database, issuing DDL only for
+# tables whose definition changed since they were last reconciled
+def reconcile(metadata=Base.metadata):
+    stored = sync_state.get_schema()
+    inspector = None
+    for table in metadata.sorted_tables:
+        current = fingerprint(table)
+        previous, deprecated = stored.get(table.name, (None, []))
+        if previous == current:
+            continue
+
+        if inspector is None:
+            inspector = inspect(engine)
+        if inspector.has_table(table.name, schema=table.schema):
+            deprecated = migrate(table, inspector, deprecated)
+        else:
+            table.create(engine)
+            deprecated = []
+        sync_state.set_schema(table.name, current, deprecated)
+
+
+# Add the columns of table missing from the database, and handle the
+# columns no longer defined with config.REMOVED_COLUMNS. deprecated are the
+# columns of table already deprecated. Returns the columns deprecated now.
+def migrate(table, inspector, deprecated=()):
+    existing = {
+        column['name']: column
+        for column in inspector.get_columns(table.name, schema=table.schema)
+    }
+    removed = [name for name in existing if name not in table.columns]
+    # A different primary key (Eg. a custom fields table switched to another
+    # layout) cannot be migrated by adding columns
+    key = inspector.get_pk_constraint(table.name, schema=table.schema)
+    if set(key['constrained_columns']) != set(table.primary_key.columns.keys()):
+        raise RuntimeError(
+            "The primary key of %s changed (Eg. its custom field layout), "
+            "drop or rename the table to sync it" % table.name)
+
+    with engine.begin() as connection:
+        preparer = connection.dialect.identifier_preparer
+        qualified = preparer.format_table(table)
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            # Added as nullable, as the existing rows have no value for it
+            connection.execute(
+                text("ALTER TABLE %s ADD %s %s" %
+                     (qualified, preparer.format_column(column),
+                      column.type.compile(dialect=connection.dialect))))
+            print("Added column %s to %s" % (column.name, table.name))
+
+        if config.REMOVED_COLUMNS == 'drop':
+            for name in removed:
+                connection.execute(
+                    text("ALTER TABLE %s DROP COLUMN %s" %
+                         (qualified, preparer.quote(name))))
+                print("Dropped column %s of %s" % (name, table.name))
+            return []
+
+    for name in removed:
+        if not existing[name]['nullable']:
+            print("Column %s of %s is no longer defined but is NOT NULL, "
+                  "rows cannot be written until it is dropped" %
+                  (name, table.name))
+        elif config.REMOVED_COLUMNS == 'deprecate' and name not in deprecated:
+            print("Column %s of %s is no longer defined, its data is kept "
+                  "and it is deprecated" % (name, table.name))
+    return removed if config.REMOVED_COLUMNS == 'deprecate' else []
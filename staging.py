@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+"""staging.py: Load into shadow tables and swap them in atomically
+
+When syncing with staging, every table of a type (Eg. Assets and
+AssetCustomFields) is loaded into a shadow table named
+[Table]__staging, created without secondary indexes. Once every page
+of the type has been written, the indexes are built once on the
+shadow tables and they are swapped in for the live tables in a single
+transaction, so readers of the live tables never see them empty or
+partially loaded. The previous live tables are dropped by the swap.
+
+Renames are transactional on PostgreSQL, Microsoft SQL Server and
+SQLite, where the swap begins its transaction explicitly since pysqlite
+only does so before DML and would commit every rename on its own. MySQL and MariaDB swap every table in one atomic RENAME TABLE.
+Oracle commits implicitly on DDL, so each rename there is atomic on its
+own but the swap of a type's tables is not.
+"""
+
+from sqlalchemy import MetaData, Index, text
+from base import engine
+
+# Suffix of shadow tables and of their indexes until swapped in
+STAGING_SUFFIX = '__staging'
+# Suffix the live tables are renamed to, just before being dropped
+OLD_SUFFIX = '__old'
+
+# Dialects where index names are unique per schema rather than per table,
+# the indexes of shadow tables must be renamed once swapped in
+SCHEMA_SCOPED_INDEXES = ('postgresql', 'oracle', 'sqlite')
+
+metadata = MetaData()
+
+
+# Returns the tables a type's rows are written to: the table of the type
+# and of its custom fields, if it has them
+def live_tables(cls):
+    tables = [cls.__table__]
+    if hasattr(cls, 'custom_fields'):
+        tables.append(cls.get_custom_type().__table__)
+    return tables
+
+
+# The name of an index, with the default naming convention for unnamed
+# indexes Eg. Column(..., index=True)
+def index_name(index):
+    if isinstance(index.name, str):
+        return index.name
+    return 'ix_%s_%s' % (index.table.name, '_'.join(
+        column.name for column in index.columns))
+
+
+# Create empty shadow tables for every table of a type, replacing any left
+# behind by a failed run unless keep is set (Eg. to resume an interrupted
+# run). Returns a dict of live Table -> shadow Table, to be passed to the
+# writer as the targets of the type's rows.
+def stage(cls, keep=False):
+    targets = {}
+    for table in live_tables(cls):
+        name = table.name + STAGING_SUFFIX
+        key = '%s.%s' % (table.schema, name) if table.schema else name
+        if key in metadata.tables:
+            metadata.remove(metadata.tables[key])
+        shadow = table.to_metadata(metadata, name=name)
+        # Loaded without secondary indexes, they are built once before the swap
+        for index in list(shadow.indexes):
+            shadow.indexes.discard(index)
+        if not keep:
+            shadow.drop(engine, checkfirst=True)
+        shadow.create(engine, checkfirst=True)
+        targets[table] = shadow
+    return targets
+
+
+# Drop the shadow tables of a failed sync, the live tables are untouched
+def discard(targets):
+    for shadow in targets.values():
+        shadow.drop(engine, checkfirst=True)
+
+
+# Build the indexes of the live tables on the loaded shadow tables, then
+# swap every shadow table in for its live table in one transaction per
+# dialect, dropping the previous live tables.
+def swap(targets):
+    dialect = engine.dialect.name
+    staged_indexes = []    # (shadow Index, name it takes once swapped in)
+    for table, shadow in targets.items():
+        for index in table.indexes:
+            name = index_name(index)
+            shadow_name = name + STAGING_SUFFIX if dialect in SCHEMA_SCOPED_INDEXES else name
+            shadow_index = Index(shadow_name,
+                                 *(shadow.columns[column.name]
+                                   for column in index.columns),
+                                 unique=index.unique)
+            shadow_index.create(engine)
+            staged_indexes.append((shadow_index, name))
+
+    with engine.begin() as connection:
+        preparer = connection.dialect.identifier_preparer
+        # pysqlite only begins a transaction before DML, the renames would
+        # otherwise each be committed as they are made
+        if dialect == 'sqlite':
+            connection.exec_driver_sql("BEGIN")
+
+        # Schema qualified and quoted name of a table named name
+        def qualified(table, name):
+            if table.schema:
+                return preparer.quote_schema(
+                    table.schema) + '.' + preparer.quote(name)
+            return preparer.quote(name)
+
+        if dialect in ('mysql', 'mariadb'):
+            # One atomic rename of every table involved
+            connection.execute(
+                text("RENAME TABLE " + ", ".join(
+                    "%s TO %s, %s TO %s" %
+                    (qualified(table, table.name),
+                     qualified(table, table.name + OLD_SUFFIX),
+                     qualified(table, shadow.name),
+                     qualified(table, table.name))
+                    for table, shadow in targets.items())))
+        else:
+            for table, shadow in targets.items():
+                rename_table(connection, qualified(table, table.name),
+                             table.name + OLD_SUFFIX)
+                rename_table(connection, qualified(table, shadow.name),
+                             table.name)
+
+        for table in targets:
+            connection.execute(
+                text("DROP TABLE " +
+                     qualified(table, table.name + OLD_SUFFIX)))
+
+        # PostgreSQL names primary keys after the table, with schema unique
+        # names. The shadow's key takes the name of the dropped live key so
+        # the next shadow table can be created
+        if dialect == 'postgresql':
+            for table, shadow in targets.items():
+                connection.execute(
+                    text("ALTER TABLE %s RENAME CONSTRAINT %s TO %s" %
+                         (qualified(table, table.name),
+                          preparer.quote(shadow.name + '_pkey'),
+                          preparer.quote(table.name + '_pkey'))))
+
+        # Indexes of the shadow tables take the names of the live indexes,
+        # which were dropped along with the previous live tables
+        for shadow_index, name in staged_indexes:
+            if shadow_index.name == name:
+                continue
+            table = shadow_index.table
+            if dialect == 'sqlite':
+                # SQLite cannot rename an index, it is rebuilt instead
+                connection.execute(
+                    text("DROP INDEX " + qualified(table, shadow_index.name)))
+                connection.execute(
+                    text("CREATE %sINDEX %s ON %s (%s)" %
+                         ('UNIQUE ' if shadow_index.unique else '',
+                          qualified(table, name), preparer.quote(
+                              table.name[:-len(STAGING_SUFFIX)]), ", ".join(
+                                  preparer.quote(column.name)
+                                  for column in shadow_index.columns))))
+            else:
+                connection.execute(
+                    text("ALTER INDEX %s RENAME TO %s" %
+                         (qualified(table, shadow_index.name),
+                          preparer.quote(name))))
+
+
+# Rename the table with the quoted, qualified name to new_name in the
+# dialect of connection
+def rename_table(connection, qualified_name, new_name):
+    if connection.dialect.name == 'mssql':
+        connection.execute(text("EXEC sp_rename :old, :new"), {
+            'old': qualified_name,
+            'new': new_name
+        })
+    else:
+        connection.execute(
+            text("ALTER TABLE %s RENAME TO %s" %
+                 (qualified_name,
+                  connection.dialect.identifier_preparer.quote(new_name))))
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+"""streaming.py: Decode the items of a page as they arrive
+
+A page decoded at once holds its whole response body, the decoded
+response and then a mapped object or row for every item in memory
+together, for every page in flight. With Streaming set in config.ini
+the items of a page are instead decoded one at a time from the response
+as it is read, and handed to the writer in batches of StreamBatchSize
+items (See writer.py). Every batch is built into objects or rows and
+flushed to the database before the next is decoded, all in the
+transaction of the page, so the memory a page holds is bounded by the
+batch size (and its largest item) rather than the page size.
+
+Decoding uses the json module's own decoder on a sliding buffer of the
+response text, so no other JSON library is required. The top level keys
+of the response other than Items (Eg. Paging) are decoded whole.
+"""
+
+import codecs
+import json
+import re
+import metrics
+
+# Bytes of the response read at a time
+CHUNK_SIZE = 65536
+
+_decoder = json.JSONDecoder()
+_whitespace = re.compile(r'[ \t\n\r]*')
+
+
+# Returns the text of the body of a streamed requests Response, read
+# CHUNK_SIZE bytes at a time, counting the bytes received for type_name
+def response_chunks(response, type_name):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        for chunk in response.iter_content(CHUNK_SIZE):
+            metrics.stats.record_bytes(type_name, len(chunk))
+            yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
+    finally:
+        response.close()
+
+
+# Returns the bytes of the body of a streamed requests Response, from its
+# Content-Length, or None when unknown or compressed
+def content_length(response):
+    length = response.headers.get('Content-Length')
+    if length is None or response.headers.get('Content-Encoding'):
+        return None
+    return int(length)
+
+
+# Returns the text of a response body already read (Eg. by aiohttp),
+# decoded CHUNK_SIZE bytes at a time so it is never copied whole
+def body_chunks(body):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    view = memoryview(body)
+    for start in range(0, len(view), CHUNK_SIZE):
+        yield decoder.decode(view[start:start + CHUNK_SIZE])
+    yield decoder.decode(b'', final=True)
+
+
+class ResponseParser:
+    """ResponseParser decodes a JSON object from an iterator of text
+    chunks. items() yields every element of its Items array one at a
+    time, the other keys of the object are kept in response once items()
+    is exhausted. Only the unparsed rest of the current chunk, and the
+    item being decoded, are held in memory.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = ''
+        self.position = 0
+        self.finished = False    # Whether every chunk has been read
+        self.response = {}    # Every top level key but Items
+
+    # Read the next chunk into the buffer, dropping what was parsed. Returns
+    # False once there are no chunks left
+    def fill(self):
+        for chunk in self.chunks:
+            if chunk:
+                self.buffer = self.buffer[self.position:] + chunk
+                self.position = 0
+                return True
+        self.finished = True
+        return False
+
+    # Returns the next character which is not whitespace, without consuming it
+    def peek(self):
+        while True:
+            self.position = _whitespace.match(self.buffer,
+                                              self.position).end()
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.fill():
+                raise ValueError("The response ended unexpectedly")
+
+    # Consume the next character which is not whitespace, which must be one
+    # of expected. Returns the character
+    def take(self, expected):
+        character = self.peek()
+        if character not in expected:
+            raise ValueError("Expected %s in the response at %r" %
+                             (" or ".join(expected),
+                              self.buffer[self.position:self.position + 40]))
+        self.position += 1
+        return character
+
+    # Decode the next JSON value, reading chunks until it is complete. The
+    # buffer is at least doubled before retrying, so a value spanning many
+    # chunks is not decoded again for every chunk
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.position)
+                # A number at the end of the buffer may continue in the next
+                if end < len(self.buffer) or self.finished:
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.finished:
+                    raise
+            wanted = 2 * (len(self.buffer) - self.position)
+            while (len(self.buffer) - self.position < wanted and
+                   self.fill()):
+                pass
+
+    # Yields every item of the Items array of the response
+    def items(self):
+        self.take('{')
+        if self.peek() == '}':
+            self.position += 1
+            return
+        while True:
+            key = self.value()
+            self.take(':')
+            if key == 'Items' and self.peek() == '[':
+                self.position += 1
+                if self.peek() == ']':
+                    self.position += 1
+                else:
+                    while True:
+                        yield self.value()
+                        if self.take(',]') == ']':
+                            break
+            else:
+                self.response[key] = self.value()
+            if self.take(',}') == '}':
+                return
+
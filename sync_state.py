@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+"""sync_state.py: Persistent state kept between syncs
+
+The SyncState table holds, for every IncidentIQ type, the high-water
+mark of the data already in the database: the latest ModifiedDate seen
+by a sync which completed without errors. Incremental syncs request only
+records modified since the stored watermark. SyncState lives outside of
+Base.metadata so it is never cleared by a full sync.
+
+Every sync also checkpoints its progress: the since and snapshot of
+every type it syncs (SyncRuns), whether the type finished, and every page durably
+committed (SyncCheckpoints). An interrupted sync resumed with --resume
+skips finished types and committed pages, refetching only the rest.
+
+SyncSchema holds the fingerprint of the definition of every table last
+reconciled with the database, and the columns of it deprecated since
+(See schema.py).
+"""
+
+import json
+import threading
+from datetime import datetime
+from sqlalchemy import MetaData, Table, Column, String, Text, Integer, Boolean, DateTime, select
+from base import engine, parse_date
+import config
+
+metadata = MetaData(schema=config.SCHEMA)
+
+sync_state = Table(config.SYNC_STATE_TABLE_NAME, metadata,
+                   Column('TypeName', String(length=128), primary_key=True),
+                   Column('Watermark', String(length=64)),
+                   Column('UpdatedDate', DateTime))
+
+sync_runs = Table(config.SYNC_RUNS_TABLE_NAME, metadata,
+                  Column('TypeName', String(length=128), primary_key=True),
+                  Column('Since', String(length=64)),
+                  Column('Until', String(length=64)),
+                  Column('Finished', Boolean),
+                  Column('UpdatedDate', DateTime))
+
+sync_checkpoints = Table(
+    config.SYNC_CHECKPOINTS_TABLE_NAME, metadata,
+    Column('TypeName', String(length=128), primary_key=True),
+    Column('PageNumber', Integer, primary_key=True, autoincrement=False),
+    Column('CommittedDate', DateTime))
+
+sync_schema = Table(config.SYNC_SCHEMA_TABLE_NAME, metadata,
+                    Column('TableName', String(length=128), primary_key=True),
+                    Column('Fingerprint', String(length=64)),
+                    Column('DeprecatedColumns', Text),
+                    Column('UpdatedDate', DateTime))
+
+
+# Create the sync state tables if they do not already exist
+def create_tables():
+    metadata.create_all(engine)
+
+
+# Returns the stored watermark of a type, or None if the type has never
+# completed a sync
+def get_watermark(type_name):
+    with engine.connect() as connection:
+        return connection.execute(
+            select(sync_state.c.Watermark).where(
+                sync_state.c.TypeName == type_name)).scalar()
+
+
+# Store the watermark of a type, replacing any previous value
+def set_watermark(type_name, watermark):
+    with engine.begin() as connection:
+        connection.execute(
+            sync_state.delete().where(sync_state.c.TypeName == type_name))
+        connection.execute(
+            sync_state.insert(), {
+                'TypeName': type_name,
+                'Watermark': watermark,
+                'UpdatedDate': datetime.utcnow()
+            })
+
+
+# Forget the progress of the previous sync, a new sync is starting
+def start_run():
+    with engine.begin() as connection:
+        connection.execute(sync_checkpoints.delete())
+        connection.execute(sync_runs.delete())
+
+
+# Record that a type is being synced with since (None for a full reload), and
+# the snapshot until of the sync
+def start_type(type_name, since=None, until=None):
+    with engine.begin() as connection:
+        connection.execute(
+            sync_runs.insert(), {
+                'TypeName': type_name,
+                'Since': since,
+                'Until': until,
+                'Finished': False,
+                'UpdatedDate': datetime.utcnow()
+            })
+
+
+# Record that every page of a type synced and the type was finalized
+def finish_type(type_name):
+    with engine.begin() as connection:
+        connection.execute(sync_runs.update().where(
+            sync_runs.c.TypeName == type_name).values(
+                Finished=True, UpdatedDate=datetime.utcnow()))
+
+
+# Returns the types of the previous sync, a dict of type name ->
+# (since, until, finished). Empty if there is no previous sync to resume.
+def get_runs():
+    with engine.connect() as connection:
+        return {
+            row.TypeName: (row.Since, row.Until, bool(row.Finished))
+            for row in connection.execute(select(sync_runs))
+        }
+
+
+# Record that a page of a type is durably committed
+def checkpoint(type_name, page_number):
+    with engine.begin() as connection:
+        connection.execute(
+            sync_checkpoints.insert(), {
+                'TypeName': type_name,
+                'PageNumber': page_number,
+                'CommittedDate': datetime.utcnow()
+            })
+
+
+# Returns the set of page numbers of a type committed by the current (or
+# interrupted) sync
+def get_checkpoints(type_name):
+    with engine.connect() as connection:
+        return set(
+            connection.execute(
+                select(sync_checkpoints.c.PageNumber).where(
+                    sync_checkpoints.c.TypeName == type_name)).scalars())
+
+
+# Forget the committed pages of a type, Eg. once its shadow tables are
+# discarded and every page must be synced again
+def clear_checkpoints(type_name):
+    with engine.begin() as connection:
+        connection.execute(sync_checkpoints.delete().where(
+            sync_checkpoints.c.TypeName == type_name))
+
+
+# Returns the reconciled tables, a dict of table name -> (fingerprint, list
+# of deprecated column names)
+def get_schema():
+    with engine.connect() as connection:
+        return {
+            row.TableName:
+            (row.Fingerprint, json.loads(row.DeprecatedColumns or '[]'))
+            for row in connection.execute(select(sync_schema))
+        }
+
+
+# Store the fingerprint and deprecated columns of a reconciled table,
+# replacing any previous values
+def set_schema(table_name, fingerprint, deprecated_columns=()):
+    with engine.begin() as connection:
+        connection.execute(
+            sync_schema.delete().where(sync_schema.c.TableName == table_name))
+        connection.execute(
+            sync_schema.insert(), {
+                'TableName': table_name,
+                'Fingerprint': fingerprint,
+                'DeprecatedColumns': json.dumps(list(deprecated_columns)),
+                'UpdatedDate': datetime.utcnow()
+            })
+
+
+class WatermarkTracker:
+    """WatermarkTracker records the latest ModifiedDate of every item
+    written during a sync, per type, and the total rows reported with
+    every page. Safe to observe from any number of worker threads at once.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latest = {}    # Type name -> (datetime, raw API date string)
+        self.totals = {}    # Type name -> set of TotalRows reported
+
+    # Observe every item of a page which has been durably written
+    def observe(self, type_name, items):
+        latest = None
+        for item in items:
+            raw = item.get('ModifiedDate')
+            parsed = parse_date(raw)
+            if parsed is not None and (latest is None or parsed > latest[0]):
+                latest = (parsed, raw)
+        if latest is None:
+            return
+        with self.lock:
+            current = self.latest.get(type_name)
+            if current is None or latest[0] > current[0]:
+                self.latest[type_name] = latest
+
+    # Observe the paging of a page which has been durably written
+    def observe_total(self, type_name, paging):
+        total = (paging or {}).get('TotalRows')
+        if total is None:
+            return
+        with self.lock:
+            self.totals.setdefault(type_name, set()).add(total)
+
+    # Whether the total rows of a type changed between its pages, records
+    # then left or joined the set while it was paged (Eg. modified again
+    # while syncing) and may have shifted others past a page already synced
+    def shifted(self, type_name):
+        with self.lock:
+            return len(self.totals.get(type_name, ())) > 1
+
+    # The latest ModifiedDate observed for a type as returned by the API,
+    # or None if no dated item was observed. When until is passed the
+    # watermark is capped to it, records created after until were left out
+    # of the sync and must still be requested by the next one
+    def watermark(self, type_name, until=None):
+        with self.lock:
+            latest = self.latest.get(type_name)
+        if latest is None:
+            return None
+        if until is not None and latest[0] > parse_date(until):
+            return until
+        return latest[1]
+
+
+class SeenKeys:
+    """SeenKeys holds the primary keys of every record written during a
+    sync, per type, so a record served twice (Eg. shifted across a page
+    boundary) is only written once. Safe to claim from any number of worker
+    threads at once.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.keys = {}    # Type name -> set of primary keys
+
+    # Claim the items of a page about to be written, returns the items whose
+    # key (the key_name field) was not already claimed, and their keys
+    def claim(self, type_name, key_name, items):
+        claimed, keys = [], []
+        with self.lock:
+            seen = self.keys.setdefault(type_name, set())
+            for item in items:
+                key = item.get(key_name)
+                if key is not None:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    keys.append(key)
+                claimed.append(item)
+        return claimed, keys
+
+    # Release keys claimed for a page which failed to be written, so the
+    # records can still be written by a retry or another page
+    def release(self, type_name, keys):
+        with self.lock:
+            self.keys.get(type_name, set()).difference_update(keys)
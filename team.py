@@ -7,13 +7,11 @@ object in SqlAlcemy. Team can be instantiated with data from
 IncidentIQ to insert into the specified database.
 """
 
-from requests.models import HTTPError
 from sqlalchemy import Column, String, Integer
 from sqlalchemy_utils.types.uuid import UUIDType as UNIQUEIDENTIFIER
 from sqlalchemy.orm import validates
 from base import Base, IIQ_Datatype as IIQ
 import config
-import requests
 
 
 class Team(Base, IIQ):
@@ -42,56 +40,16 @@ class Team(Base, IIQ):
         return super().validate_inserts(key, value)
 
     def __init__(self, data):
-        # Extract fields from the raw data, optional nested fields
-        # can be retrieved easily with find_element *args (See asset.py)
-        for field in self.fields:
-            # For non-nested fields that exist at the first level of the JSON
-            # we can use setattr to assign values, since the fields are
-            # named exactly as they appear in the JSON. For example, an asset
-            # JSON response will have a field 'AssetId' at the base level of that item.
-            # Thus, find_element can grab it simply by being passed 'AssetId'. By design,
-            # the column is also named 'AssetId', so we can iterate simply and set these fields.
-            setattr(self, field, IIQ.find_element(data, field))
+        # Extract fields from the raw data with the extractor compiled from
+        # fields, optional nested fields can be declared in paths (See asset.py)
+        self.set_fields(data)
 
     @staticmethod
-    def get_data_request(page):
-        url = "https://" + config.IIQ_INSTANCE + "/api/v1.0/teams/all?$s=" + str(
+    def page_request(page):
+        path = "/api/v1.0/teams/all?$s=" + str(
             config.PAGE_SIZE) + "&$d=Descending&$p=" + str(page)
-        payload = {}
-        files = {}
-        headers = {
-            'Client': 'WebBrowser',
-            'Accept': 'application/json, text/plain, */*',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/69.0.3497.100 Safari/537.36',
-            'Pragma': 'no-cache',
-            'Accept-Encoding': 'gzip, deflate',
-            'Content-Type': 'application/json',
-            'Authorization': 'Bearer ' + config.IIQ_TOKEN
-        }
-
-        response = requests.request("GET",
-                                    url,
-                                    headers=headers,
-                                    data=payload,
-                                    files=files,
-                                    timeout=config.TIMEOUT)
-
-        # Cause an exception if anything but success is returned
-        if response.status_code != 200:
-            raise HTTPError("""A request returned a status code other than 200\n
-            Status Code: """ + str(response.status_code))
-
-        # Cause an exception if for some reason the API returns nothing
-        if response.json()['Paging']['PageSize'] <= 0:
-            raise HTTPError("No elements were returned from a request")
-
-        # Return the response
-        return response
-
-    @staticmethod
-    def get_num_pages():
-        return Team.get_data_request(0).json()['Paging']['PageCount']
+        return "GET", path, None
 
     @classmethod
-    def get_page(cls, page_number):
-        return super().get_page(page_number)
+    def get_page(cls, page_number, page=None):
+        return super().get_page(page_number, page)
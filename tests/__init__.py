@@ -0,0 +1,5 @@
+"""tests: Checks of behaviour which benchmarks cannot show
+
+Run them from the repository root, Eg.
+python -m unittest discover tests
+"""
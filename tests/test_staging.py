@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+"""test_staging.py: The swap of shadow tables is atomic
+
+config.py reads config.ini from the working directory once imported, so
+every check runs in a subprocess in a temporary directory with a
+config.ini of its own syncing into a SQLite database (See
+benchmarks/bench_sync.py). The config.ini of the repository is not
+touched.
+
+Usage: python -m unittest tests.test_staging
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+from benchmarks.bench_sync import CONFIG
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Stages a table holding one live row, swaps it in with the swap failing
+# after its first rename, then swaps it in again
+SWAP = textwrap.dedent("""
+    import sqlite3
+    import sys
+    from sqlalchemy import MetaData, Table, Column, Integer, String
+    from base import engine
+    import staging
+
+    metadata = MetaData()
+    table = Table('Things', metadata, Column('Id', Integer, primary_key=True),
+                  Column('Name', String(20), index=True))
+    metadata.create_all(engine)
+    with engine.begin() as connection:
+        connection.execute(table.insert(), {'Id': 1, 'Name': 'live'})
+
+
+    class Thing:
+        __table__ = table
+
+
+    # Returns the names of the tables in the database and the rows of Things,
+    # read over a connection of its own
+    def read():
+        connection = sqlite3.connect(sys.argv[1])
+        try:
+            tables = {
+                name for name, in connection.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table'")
+            }
+            rows = list(connection.execute('SELECT Id, Name FROM Things'))
+        finally:
+            connection.close()
+        return tables, rows
+
+
+    def stage():
+        targets = staging.stage(Thing)
+        with engine.begin() as connection:
+            connection.execute(targets[table].insert(), {
+                'Id': 2,
+                'Name': 'staged'
+            })
+        return targets
+
+
+    rename_table = staging.rename_table
+    renames = []
+
+
+    # Interrupt the swap once the live table was renamed
+    def interrupted_rename(connection, qualified_name, new_name):
+        if renames:
+            raise RuntimeError('interrupted')
+        renames.append(new_name)
+        rename_table(connection, qualified_name, new_name)
+
+
+    staging.rename_table = interrupted_rename
+    try:
+        staging.swap(stage())
+        sys.exit('The interrupted swap did not raise')
+    except RuntimeError:
+        pass
+    tables, rows = read()
+    assert 'Things__old' not in tables, tables
+    assert rows == [(1, 'live')], rows
+
+    staging.rename_table = rename_table
+    staging.swap(stage())
+    tables, rows = read()
+    assert tables == {'Things'}, tables
+    assert rows == [(2, 'staged')], rows
+    """)
+
+
+class SwapTest(unittest.TestCase):
+    """SwapTest checks an interrupted swap leaves the live tables as they
+    were, rather than renamed away.
+    """
+
+    def test_interrupted_swap_is_rolled_back(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database = os.path.join(directory, 'staging.db')
+            with open(os.path.join(directory, 'config.ini'),
+                      'w') as config_file:
+                config_file.write(
+                    CONFIG.format(database=database,
+                                  port=0,
+                                  page_size=100,
+                                  directory=directory,
+                                  engine='threads',
+                                  write_mode='core'))
+            environment = dict(os.environ)
+            environment['PYTHONPATH'] = os.pathsep.join(
+                filter(None, [ROOT, environment.get('PYTHONPATH')]))
+            swap = subprocess.run([sys.executable, '-c', SWAP, database],
+                                  cwd=directory,
+                                  env=environment,
+                                  stdout=subprocess.PIPE,
+                                  stderr=subprocess.STDOUT)
+            self.assertEqual(swap.returncode, 0,
+                             swap.stdout.decode(errors='replace'))
+
+
+if __name__ == '__main__':
+    unittest.main()
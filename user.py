@@ -7,14 +7,13 @@ object in SqlAlcemy. User can be instantiated with data from
 IncidentIQ to insert into the specified database.
 """
 
-from requests.models import HTTPError
 from sqlalchemy import Column, String, Integer, Date, Boolean
 from sqlalchemy_utils.types.uuid import UUIDType as UNIQUEIDENTIFIER
 from sqlalchemy.orm import validates
 from base import Base, IIQ_Datatype as IIQ
 from custom_fields import UserCustomFields
 import config
-import requests
+import json
 
 
 class User(Base, IIQ):
@@ -32,8 +31,7 @@ class User(Base, IIQ):
         __table_args__ = {'schema': config.SCHEMA}
 
     # Retreive custom fields
-    custom_fields = UserCustomFields.parse_fields(
-        UserCustomFields.get_fields_request(0))
+    custom_fields = UserCustomFields.field_definitions
 
     UserId = Column(UNIQUEIDENTIFIER(binary=False), primary_key=True)
     IsDeleted = Column(Boolean)
@@ -81,55 +79,26 @@ class User(Base, IIQ):
         return super().validate_inserts(key, value)
 
     def __init__(self, data):
-        # Extract fields from the raw data, optional nested fields
-        # can be retrieved easily with find_element *args (See asset.py)
-        for field in self.fields:
-            # For non-nested fields that exist at the first level of the JSON
-            # we can use setattr to assign values, since the fields are
-            # named exactly as they appear in the JSON. For example, an asset
-            # JSON response will have a field 'AssetId' at the base level of that item.
-            # Thus, find_element can grab it simply by being passed 'AssetId'. By design,
-            # the column is also named 'AssetId', so we can iterate simply and set these fields.
-            setattr(self, field, IIQ.find_element(data, field))
+        # Extract fields from the raw data with the extractor compiled from
+        # fields, optional nested fields can be declared in paths (See asset.py)
+        self.set_fields(data)
 
-    @staticmethod
-    def get_data_request(page):
-        url = "https://" + config.IIQ_INSTANCE + "/services/users?$o=UserId&$s=" + str(
+    # Users can be requested modified since a watermark
+    incremental = True
+
+    @classmethod
+    def page_request(cls, page, since=None):
+        # Always sorted by UserId, changes made during the sync then never
+        # move a record to another page. A user created meanwhile does,
+        # shifting every user after its id by one (See README.md)
+        path = "/services/users?$o=UserId&$s=" + str(
             config.PAGE_SIZE) + "&$d=Ascending&$p=" + str(page)
-        payload = {}
-        files = {}
-        headers = {
-            'Client': 'WebBrowser',
-            'Accept': 'application/json, text/plain, */*',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/69.0.3497.100 Safari/537.36',
-            'Pragma': 'no-cache',
-            'Accept-Encoding': 'gzip, deflate',
-            'Content-Type': 'application/json',
-            'Authorization': 'Bearer ' + config.IIQ_TOKEN
-        }
-
-        response = requests.request("POST",
-                                    url,
-                                    headers=headers,
-                                    data=payload,
-                                    files=files,
-                                    timeout=config.TIMEOUT)
-
-        # Cause an exception if anything but success is returned
-        if response.status_code != 200:
-            raise HTTPError("""A request returned a status code other than 200\n
-            Status Code: """ + str(response.status_code))
-
-        # Cause an exception if for some reason the API returns nothing
-        if response.json()['Paging']['PageSize'] <= 0:
-            raise HTTPError("No elements were returned from a request")
-
-        # Return the response
-        return response
 
-    @staticmethod
-    def get_num_pages():
-        return User.get_data_request(0).json()['Paging']['PageCount']
+        # Only changes are filtered for, otherwise the body is empty
+        filters = cls.request_filters(since)
+        payload = json.dumps({"Filters": filters}) if filters else None
+
+        return "POST", path, payload
 
     @staticmethod
     def get_custom_type():
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""writer.py: Writes decoded API pages into the database
+
+Three write modes are available, selected by WriteMode in config.ini.
+The orm mode instantiates mapped objects for every item and adds them
+to an SqlAlchemy session. The core mode skips the ORM unit of work
+entirely, transforming a page into plain row dicts and bulk loading
+them per table with the fastest Loader for the database dialect
+(See loaders.py). The upsert mode writes plain rows like core, but
+updates rows which already exist with the same primary key, so pages
+can be retried without duplicates or integrity errors. Rows written
+and time spent writing are recorded per table so throughput can be
+reported after a sync, and the time every page spent flushing and
+committing is recorded per type (See metrics.py).
+"""
+
+import threading
+import time
+from sqlalchemy import text
+from base import Session, engine, IIQ_Datatype, Page
+import config
+import loaders
+import metrics
+import profiling
+
+
+class WriteStats:
+    """WriteStats accumulates the number of rows written and the time
+    spent writing them for every table. Safe to record into from any
+    number of worker threads at once.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = {}    # Table name -> [rows, seconds]
+
+    def record(self, table_name, rows, seconds):
+        with self.lock:
+            totals = self.tables.setdefault(table_name, [0, 0.0])
+            totals[0] += rows
+            totals[1] += seconds
+
+    # Returns one line per table, Eg.
+    # 'Assets: 12000 rows in 3.20 s (3750 rows/sec)'
+    def report(self):
+        lines = []
+        with self.lock:
+            for table_name, (rows, seconds) in self.tables.items():
+                rate = rows / seconds if seconds > 0 else 0
+                lines.append("%s: %d rows in %.2f s (%.0f rows/sec)" %
+                             (table_name, rows, seconds, rate))
+        return "\n".join(lines)
+
+
+# Statistics for every write made in this process
+stats = WriteStats()
+
+
+# Write a page by adding a mapped object for every item to a session. When
+# replace is set, rows already in the database with the same primary key
+# are replaced (merged) rather than causing an error. prepare is optionally
+# called with every batch of the page before it is written (See write_page).
+def write_orm(cls: IIQ_Datatype, page: Page, replace=False, prepare=None):
+    start = time.perf_counter()
+    session = Session()
+    written = 0
+    build = flush = 0.0
+    try:
+        for batch in page.batches():
+            if prepare is not None:
+                prepare(batch)
+            build_start = time.perf_counter()
+            with profiling.page_memory(cls.__name__, batch.number):
+                objects = cls.get_page(batch.number, batch)
+            # Add each object to the session and flush it
+            flush_start = time.perf_counter()
+            if replace:
+                for obj in objects:
+                    session.merge(obj)
+            else:
+                session.add_all(objects)
+            session.flush()
+            # Flushed objects are not needed to commit, only the batch being
+            # written is held by the session
+            session.expunge_all()
+            build += flush_start - build_start
+            flush += time.perf_counter() - flush_start
+            written += len(objects)
+        metrics.stats.record(cls.__name__, 'build', build)
+        metrics.stats.record(cls.__name__, 'flush', flush)
+        with metrics.stats.time(cls.__name__, 'commit'):
+            session.commit()
+    finally:
+        session.close()
+    stats.record(cls.__tablename__, written, time.perf_counter() - start)
+
+
+# Bulk loader for the configured database
+loader = loaders.get_loader(engine, config.BATCH_SIZE)
+
+
+# Write a page as plain rows, bypassing the ORM. Every table of the page is
+# bulk loaded in batches of at most config.BATCH_SIZE rows at a time, all in
+# a single transaction. When replace is set, or in the upsert WriteMode, rows
+# already in the database with the same primary key are updated. targets
+# optionally maps tables to the tables their rows are written to instead.
+# prepare is optionally called with every batch of the page before it is
+# written (See write_page).
+def write_core(cls: IIQ_Datatype,
+               page: Page,
+               replace=False,
+               targets=None,
+               prepare=None):
+    upsert = replace or config.WRITE_MODE == 'upsert'
+    # Custom fields in the long layout have a row per item and field, the
+    # rows of every item of the page are deleted and written again together
+    long_table = None
+    if upsert and hasattr(cls, 'custom_fields'):
+        Custom_Type = cls.get_custom_type()
+        if Custom_Type.layout == 'long':
+            long_table = Custom_Type.__table__
+    build = flush = 0.0
+    with engine.begin() as connection:
+        for batch in page.batches():
+            if prepare is not None:
+                prepare(batch)
+            build_start = time.perf_counter()
+            with profiling.page_memory(cls.__name__, batch.number):
+                rows_by_table = cls.get_rows(batch)
+            flush_start = time.perf_counter()
+            build += flush_start - build_start
+            if long_table is not None:
+                table = long_table
+                if targets is not None:
+                    table = targets.get(table, table)
+                start = time.perf_counter()
+                loader.delete_keys(connection, table,
+                                   Custom_Type.primarykey_name, [
+                                       row[Custom_Type.primarykey_name]
+                                       for row in rows_by_table[cls.__table__]
+                                   ])
+                stats.record(table.name, 0, time.perf_counter() - start)
+            for table, rows in rows_by_table.items():
+                replaced = table is long_table
+                if targets is not None:
+                    table = targets.get(table, table)
+                start = time.perf_counter()
+                if upsert and not replaced:
+                    loader.upsert(connection, table, rows)
+                else:
+                    loader.load(connection, table, rows)
+                stats.record(table.name, len(rows),
+                             time.perf_counter() - start)
+            flush += time.perf_counter() - flush_start
+        # The transaction commits when the with statement exits
+        commit_start = time.perf_counter()
+    metrics.stats.record(cls.__name__, 'build', build)
+    metrics.stats.record(cls.__name__, 'flush', flush)
+    metrics.stats.record(cls.__name__, 'commit',
+                         time.perf_counter() - commit_start)
+
+
+# Delete every row of the table of a type, and of its custom fields table.
+# Tables are truncated where the dialect can, which unlike a DELETE does not
+# log every row removed
+def clear(cls: IIQ_Datatype):
+    tables = [cls.__table__]
+    if hasattr(cls, 'custom_fields'):
+        tables.insert(0, cls.get_custom_type().__table__)
+    with engine.begin() as connection:
+        preparer = connection.dialect.identifier_preparer
+        for table in tables:
+            if connection.dialect.name == 'sqlite':
+                connection.execute(table.delete())
+            else:
+                connection.execute(
+                    text("TRUNCATE TABLE " + preparer.format_table(table)))
+
+
+# Write a page of the given type with the configured WriteMode, a decoded
+# Page or a StreamedPage written one batch of items at a time in a single
+# transaction. prepare is optionally called with every batch (a Page) before
+# it is written, and may change its items. Rows redirected to other tables
+# with targets (Eg. staging), and types with custom fields in the long or
+# json layout, are always written as plain rows, since mapped objects are
+# bound to their own table and to one row per item.
+def write_page(cls: IIQ_Datatype,
+               page: Page,
+               replace=False,
+               targets=None,
+               prepare=None):
+    if (config.WRITE_MODE in ('core', 'upsert') or targets is not None or
+            hasattr(cls, 'custom_fields') and
+            cls.get_custom_type().layout != 'wide'):
+        write_core(cls, page, replace, targets, prepare)
+    else:
+        write_orm(cls, page, replace, prepare)